@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""Times GTF loading, BED ingestion, the nearby-gene query and the landing page.
+
+Every stage runs in a fresh process - once through the Flask test client ('http', uploads
+are polled until their background job has finished) and once by calling the functions of
+flask_app.py directly ('direct') - against its own database under the work directory. Wall time, rows per second and the peak RSS of the
+stage process are written as JSON, which --compare turns into a side by side report
+against the JSON of another commit.
+
+    python3 benchmarks/run_benchmarks.py --genes 20000 --peaks 1000000 --output new.json
+    python3 benchmarks/run_benchmarks.py --compare old.json new.json
+"""
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+DB_DEFINITION_DIR = os.path.join(REPO_DIR, "db_definition")
+SETUP_SQL = os.path.join(DB_DEFINITION_DIR, "setup_db.sql")
+
+sys.path.insert(0, BENCHMARK_DIR)
+from synthetic_data import write_beds, write_gtf
+
+MODES = ("http", "direct")
+
+
+def peak_rss_kb():
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def import_app(pgdata):
+    os.environ["PGDATA"] = pgdata
+    sys.path.insert(0, DB_DEFINITION_DIR)
+    import db_pool
+    # outside the image the schema is read from the checkout instead of /etc
+    db_pool.SETUP_SQL_PATH = SETUP_SQL
+    import flask_app
+    return flask_app
+
+
+def count_rows(pgdata, query):
+    conn = sqlite3.connect(os.path.join(pgdata, "genome.db"))
+    count = conn.execute(query).fetchone()[0]
+    conn.close()
+    return count
+
+
+def check_status(response, expected):
+    if response.status_code not in expected:
+        raise RuntimeError(f"unexpected HTTP status {response.status_code}: {response.data[:200]!r}")
+
+
+def wait_for_job(client, response):
+    """Polls the background job an upload returned until it has finished."""
+    check_status(response, (202,))
+    job = response.get_json()
+    while job["status"] in ("queued", "running"):
+        time.sleep(0.01)
+        job = client.get(f"/jobs/{job['id']}").get_json()
+    if job["status"] != "done":
+        raise RuntimeError(f"upload job {job['id']} {job['status']}: {job['message']}")
+
+
+def stage_gtf_load(flask_app, mode, params):
+    path = params["gtf"]
+    with open(path, "rb") as gtf:
+        if mode == "http":
+            client = flask_app.app.test_client()
+            response = client.post("/upload_gtf", data={"gtffile": (gtf, os.path.basename(path))},
+                                   content_type="multipart/form-data", headers={"Accept": "application/json"})
+            wait_for_job(client, response)
+        else:
+            from werkzeug.datastructures import FileStorage
+            flask_app.load_gtf_to_postgres(FileStorage(stream=gtf, filename=os.path.basename(path)))
+    return {"rows": count_rows(params["pgdata"], "SELECT (SELECT count(*) FROM genes) + (SELECT count(*) FROM transcripts)")}
+
+
+def stage_bed_load(flask_app, mode, params):
+    client = flask_app.app.test_client()
+    for number, path in enumerate(params["beds"], start=1):
+        name = f"experiment_{number}"
+        if mode == "http":
+            with open(path, "rb") as bed:
+                response = client.post("/upload_bed", data={"new_experiment_name": name, "file": (bed, os.path.basename(path))},
+                                       content_type="multipart/form-data", headers={"Accept": "application/json"})
+            wait_for_job(client, response)
+        else:
+            conn = flask_app.create_connection()
+            cur = conn.cursor()
+            cur.execute("INSERT INTO experiments (experiment_name, description) VALUES (?, ?);", (name, "benchmark"))
+            experiment_id = cur.lastrowid
+            conn.commit()
+            conn.close()
+            flask_app.load_bed_file(path, experiment_id)
+    return {"rows": count_rows(params["pgdata"], "SELECT count(*) FROM bed")}
+
+
+def stage_genes_near_peaks(flask_app, mode, params):
+    distance = params["distance"]
+    parallel = params.get("parallel", False)
+    start = time.perf_counter()
+    first_byte = None
+    rows = 0
+    size = 0
+    if mode == "http":
+        # the serial and the parallel stage ask for the same result: time the query, not
+        # the copy the previous stage left in the result cache
+        shutil.rmtree(flask_app.get_result_cache().directory, ignore_errors=True)
+        client = flask_app.app.test_client()
+        data = {"distance": distance, "parallel": "1" if parallel else ""}
+        response = client.post("/get_genes", data=data, buffered=False)
+        check_status(response, (200,))
+        for chunk in response.response:
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            rows += chunk.count(b"\n")
+            size += len(chunk)
+        response.close()
+        rows -= 1  # header line
+    else:
+        query = flask_app.iter_genes_near_peaks_parallel if parallel else flask_app.iter_genes_near_peaks
+        for chunk in query(distance):
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            rows += len(chunk)
+    return {"rows": rows, "bytes": size, "first_byte_seconds": first_byte}
+
+
+def stage_index_page(flask_app, mode, params):
+    repeats = params["index_repeats"]
+    client = flask_app.app.test_client()
+    for _ in range(repeats):
+        if mode == "http":
+            check_status(client.get("/"), (200,))
+        else:
+            with flask_app.app.test_request_context("/"):
+                flask_app.index()
+    return {"rows": repeats}
+
+
+STAGES = {
+    "gtf_load": stage_gtf_load,
+    "bed_load": stage_bed_load,
+    "genes_near_peaks": stage_genes_near_peaks,
+    "genes_near_peaks_parallel": lambda flask_app, mode, params: stage_genes_near_peaks(flask_app, mode, dict(params, parallel=True)),
+    "index_page": stage_index_page,
+}
+
+
+def run_stage(stage, mode, params):
+    """Runs one stage in the current (fresh) process and returns its measurements."""
+    flask_app = import_app(params["pgdata"])
+    rss_start = peak_rss_kb()
+    start = time.perf_counter()
+    result = STAGES[stage](flask_app, mode, params)
+    seconds = time.perf_counter() - start
+    result.update({
+        "stage": stage,
+        "mode": mode,
+        "seconds": seconds,
+        "rows_per_second": result["rows"] / seconds if seconds > 0 else None,
+        "rss_start_kb": rss_start,
+        "peak_rss_kb": peak_rss_kb(),
+    })
+    if "distance" in params:
+        result["distance"] = params["distance"]
+    return result
+
+
+def run_in_fresh_process(stage, mode, params):
+    # spawn: no memory inherited from this process, so peak_rss_kb belongs to the stage alone
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_stage, stage, mode, params).result()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "-C", REPO_DIR, "rev-parse", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args):
+    data_dir = os.path.join(args.workdir, "data")
+    shutil.rmtree(args.workdir, ignore_errors=True)
+    os.makedirs(data_dir)
+
+    suffix = ".gz" if args.gzip else ""
+    gtf = os.path.join(data_dir, "synthetic.gtf" + suffix)
+    write_gtf(gtf, args.genes, seed=args.seed)
+    beds = write_beds(data_dir, args.peaks, args.experiments, seed=args.seed, compress=args.gzip)
+
+    results = []
+    for mode in args.modes:
+        pgdata = os.path.join(args.workdir, mode)
+        os.makedirs(pgdata)
+        params = {"pgdata": pgdata, "gtf": gtf, "beds": beds, "index_repeats": args.index_repeats}
+
+        stages = [("gtf_load", params), ("bed_load", params)]
+        stages += [("genes_near_peaks", dict(params, distance=distance)) for distance in args.distances]
+        stages += [("genes_near_peaks_parallel", dict(params, distance=distance)) for distance in args.distances]
+        stages += [("index_page", params)]
+        for stage, stage_params in stages:
+            result = run_in_fresh_process(stage, mode, stage_params)
+            results.append(result)
+            print(format_result(result), flush=True)
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "parameters": {
+                "genes": args.genes, "peaks": args.peaks, "experiments": args.experiments,
+                "seed": args.seed, "gzip": args.gzip, "distances": args.distances,
+                "index_repeats": args.index_repeats,
+            },
+        },
+        "results": results,
+    }
+
+
+def result_key(result):
+    return (result["stage"], result["mode"], result.get("distance"))
+
+
+def format_key(key):
+    stage, mode, distance = key
+    return f"{stage}{'' if distance is None else f'[{distance}]'} ({mode})"
+
+
+def format_result(result):
+    rate = result["rows_per_second"]
+    return (f"{format_key(result_key(result)):<45} {result['seconds']:10.3f} s  {result['rows']:>12} rows  "
+            f"{rate or 0:>12.0f} rows/s  {result['peak_rss_kb'] / 1024:8.1f} MB peak RSS")
+
+
+def compare(old_path, new_path):
+    with open(old_path) as old_file, open(new_path) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+    print(f"old: {old['meta'].get('commit')}  new: {new['meta'].get('commit')}")
+    if old["meta"]["parameters"] != new["meta"]["parameters"]:
+        print("warning: the two runs used different parameters")
+    old_results = {result_key(result): result for result in old["results"]}
+    print(f"{'stage':<35} {'old s':>10} {'new s':>10} {'speedup':>8} {'old MB':>8} {'new MB':>8}")
+    for result in new["results"]:
+        key = result_key(result)
+        before = old_results.get(key)
+        if before is None:
+            print(f"{format_key(key):<35} {'-':>10} {result['seconds']:10.3f}")
+            continue
+        speedup = before["seconds"] / result["seconds"] if result["seconds"] else float("inf")
+        print(f"{format_key(key):<35} {before['seconds']:10.3f} {result['seconds']:10.3f} {speedup:7.2f}x "
+              f"{before['peak_rss_kb'] / 1024:8.1f} {result['peak_rss_kb'] / 1024:8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ChipSQLInterface on synthetic genome-scale data")
+    parser.add_argument("--genes", type=int, default=20000, help="Number of genes in the synthetic GTF")
+    parser.add_argument("--peaks", type=int, default=100000, help="Total number of peaks over all experiments")
+    parser.add_argument("--experiments", type=int, default=4, help="Number of BED files / experiments")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed of the data generators")
+    parser.add_argument("--gzip", action="store_true", help="Benchmark with gzip compressed input files")
+    parser.add_argument("--distances", type=int, nargs="+", default=[1000, 10000, 50000],
+                        help="Distances for the nearby-gene query")
+    parser.add_argument("--index-repeats", type=int, default=20, help="Number of landing page requests")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES),
+                        help="Run through the Flask test client, directly or both")
+    parser.add_argument("--workdir", default=os.path.join(REPO_DIR, "benchmark_work"),
+                        help="Scratch directory for data and databases (deleted first)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD_JSON", "NEW_JSON"),
+                        help="Compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = run_benchmarks(args)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
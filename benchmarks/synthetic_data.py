@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""Seeded generators for genome-scale synthetic GTF and BED files.
+
+The same seed and sizes always produce byte-identical files, so benchmark results from
+different commits are comparable.
+"""
+
+import argparse
+import gzip
+import os
+import random
+
+# Mouse (GRCm39) chromosome lengths - positions are drawn proportional to these
+CHROMOSOME_LENGTHS = {
+    "chr1": 195154279, "chr2": 181755017, "chr3": 159745316, "chr4": 156860686,
+    "chr5": 151758149, "chr6": 149588044, "chr7": 144995196, "chr8": 130127694,
+    "chr9": 124359700, "chr10": 130530862, "chr11": 121973369, "chr12": 120092757,
+    "chr13": 120883175, "chr14": 125139656, "chr15": 104073951, "chr16": 98008968,
+    "chr17": 95294699, "chr18": 90720763, "chr19": 61420004, "chrX": 169476592,
+    "chrY": 91455967,
+}
+
+
+def open_output(path):
+    # .gz paths are written gzip compressed, like the pipeline outputs the server accepts
+    if path.endswith(".gz"):
+        return gzip.open(path, "wt")
+    return open(path, "w")
+
+
+def random_position(rng, chromosomes, weights):
+    chromosome = rng.choices(chromosomes, weights)[0]
+    return chromosome, rng.randint(1, CHROMOSOME_LENGTHS[chromosome])
+
+
+def write_gtf(path, n_genes, seed=1, max_transcripts=4, max_exons=8):
+    """Writes a GENCODE-like GTF with n_genes genes on both strands.
+
+    Every gene gets 1..max_transcripts transcripts and every transcript 1..max_exons exons,
+    with the attribute columns GENCODE uses. Genes are sorted by chromosome and start.
+    Returns the number of lines written.
+    """
+    rng = random.Random(seed)
+    chromosomes = list(CHROMOSOME_LENGTHS)
+    weights = [CHROMOSOME_LENGTHS[c] for c in chromosomes]
+
+    genes = []
+    for index in range(n_genes):
+        chromosome, start = random_position(rng, chromosomes, weights)
+        # gene lengths are roughly log-normal: most genes 5-50 kb, a few several 100 kb
+        length = min(int(rng.lognormvariate(9.5, 1.2)) + 200, 2000000)
+        stop = min(start + length, CHROMOSOME_LENGTHS[chromosome])
+        genes.append((chromosome, start, stop, rng.choice("+-"), index))
+    genes.sort(key=lambda gene: (chromosomes.index(gene[0]), gene[1]))
+
+    lines = 0
+    with open_output(path) as gtf:
+        gtf.write("##description: synthetic annotation generated by benchmarks/synthetic_data.py\n")
+        for chromosome, start, stop, strand, index in genes:
+            gene_id = f"ENSMUSG{index:011d}.1"
+            gene_name = f"Gene{index}"
+            gene_attributes = (f'gene_id "{gene_id}"; gene_type "protein_coding"; '
+                               f'gene_name "{gene_name}"; level 2; mgi_id "MGI:{index}";')
+            gtf.write(f"{chromosome}\tSYNTH\tgene\t{start}\t{stop}\t.\t{strand}\t.\t{gene_attributes}\n")
+            lines += 1
+
+            for t in range(rng.randint(1, max_transcripts)):
+                t_start = start + rng.randint(0, (stop - start) // 10)
+                t_stop = stop - rng.randint(0, (stop - start) // 10)
+                transcript_id = f"ENSMUST{index:011d}{t}.1"
+                transcript_attributes = (
+                    f'gene_id "{gene_id}"; transcript_id "{transcript_id}"; gene_type "protein_coding"; '
+                    f'gene_name "{gene_name}"; transcript_type "protein_coding"; '
+                    f'transcript_name "{gene_name}-{201 + t}"; level 2; tag "basic";')
+                gtf.write(f"{chromosome}\tSYNTH\ttranscript\t{t_start}\t{t_stop}\t.\t{strand}\t.\t{transcript_attributes}\n")
+                lines += 1
+
+                n_exons = rng.randint(1, max_exons)
+                exon_length = max((t_stop - t_start) // (2 * n_exons), 1)
+                for e in range(n_exons):
+                    e_start = t_start + 2 * e * exon_length
+                    e_stop = min(e_start + exon_length, t_stop)
+                    exon_attributes = f'{transcript_attributes} exon_number {e + 1};'
+                    gtf.write(f"{chromosome}\tSYNTH\texon\t{e_start}\t{e_stop}\t.\t{strand}\t.\t{exon_attributes}\n")
+                    lines += 1
+    return lines
+
+
+def write_beds(directory, n_peaks, n_experiments, seed=1, compress=False):
+    """Writes n_experiments BED files with n_peaks peaks in total.
+
+    Peaks have MACS-like widths and scores and are sorted by chromosome and start.
+    Returns the list of file paths.
+    """
+    rng = random.Random(seed)
+    chromosomes = list(CHROMOSOME_LENGTHS)
+    weights = [CHROMOSOME_LENGTHS[c] for c in chromosomes]
+    os.makedirs(directory, exist_ok=True)
+
+    paths = []
+    for experiment in range(n_experiments):
+        count = n_peaks // n_experiments + (1 if experiment < n_peaks % n_experiments else 0)
+        peaks = []
+        for _ in range(count):
+            chromosome, start = random_position(rng, chromosomes, weights)
+            width = int(rng.gammavariate(2.0, 250)) + 50
+            peaks.append((chromosomes.index(chromosome), start, start + width, round(rng.expovariate(0.1), 3)))
+        peaks.sort()
+
+        path = os.path.join(directory, f"experiment_{experiment + 1}.bed" + (".gz" if compress else ""))
+        with open_output(path) as bed:
+            for number, (chromosome, start, stop, score) in enumerate(peaks):
+                bed.write(f"{chromosomes[chromosome]}\t{start}\t{stop}\tpeak_{number}\t{score}\n")
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write seeded synthetic GTF and BED files")
+    parser.add_argument("output_dir", help="Directory the files are written to")
+    parser.add_argument("--genes", type=int, default=20000, help="Number of genes in the GTF")
+    parser.add_argument("--peaks", type=int, default=100000, help="Total number of peaks over all BED files")
+    parser.add_argument("--experiments", type=int, default=4, help="Number of BED files")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    parser.add_argument("--gzip", action="store_true", help="Write .gtf.gz / .bed.gz files")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    gtf_path = os.path.join(args.output_dir, "synthetic.gtf" + (".gz" if args.gzip else ""))
+    lines = write_gtf(gtf_path, args.genes, seed=args.seed)
+    print(f"{gtf_path}: {lines} lines")
+    for path in write_beds(args.output_dir, args.peaks, args.experiments, seed=args.seed, compress=args.gzip):
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""Streaming BED parser shared by the Flask upload (flask_app.py) and the bulk loader (bulk_load_bed.py)."""
+
+
+def iter_bed_rows(lines, experiment_id):
+    """Yields [experiment_id, chromosome, start, stop, peak_score, feature_name] for every peak.
+
+    lines can be any iterable of str or bytes lines (an open file, a werkzeug upload stream).
+    Comment lines are skipped; peak_score defaults to 0.0 and feature_name to '-'.
+    Raises ValueError for lines with fewer than three columns.
+    """
+    for line_number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if line.startswith('#'):  # Skip comment lines
+            continue
+        parts = line.strip().split('\t')
+        if len(parts) < 3:
+            raise ValueError(f"error on bed file line {line_number}")
+
+        # Extract the necessary columns from the BED file
+        peak_score = float(parts[4]) if len(parts) > 4 else 0.0
+        feature_name = parts[3] if len(parts) > 3 else "-"
+        yield [experiment_id, parts[0], int(parts[1]), int(parts[2]), peak_score, feature_name]
+
+
+def max_peak_widths(bed_rows):
+    """{chromosome: widest stop - start} of rows as yielded by iter_bed_rows, for every chromosome of the rows."""
+    widths = {}
+    for row in bed_rows:
+        width = row[3] - row[2]
+        if row[1] not in widths or width > widths[row[1]]:
+            widths[row[1]] = width
+    return widths
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""Bulk loader for many BED files, e.g. all peak files of a pipeline run.
+
+    bulk_load_bed.py peaks_dir/                 # every .bed / .bed.gz file, one experiment each
+    bulk_load_bed.py manifest.tsv               # path <tab> experiment name [<tab> description]
+
+The files are parsed in worker processes; the main process is the only writer and inserts
+the peaks in large transactions. The bed indexes are dropped for the load and built once at
+the end, together with an update of the co-occupancy matrix. Run it while the web server is
+idle - its queries are slow without the indexes. Files already loaded into their experiment
+(same SHA-256) are skipped, so a run can be repeated after adding files.
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from bed_parser import iter_bed_rows, max_peak_widths
+from density_tracks import bin_peaks
+from input_streams import hash_file, open_input, strip_compression_suffix
+
+# Peaks inserted per transaction
+TRANSACTION_ROWS = 2000000
+
+BED_SUFFIXES = ('.bed',)
+
+
+def experiment_name_of(path):
+    """'run1/H3K27ac_rep1.bed.gz' -> 'H3K27ac_rep1'"""
+    name = strip_compression_suffix(os.path.basename(path))
+    stem, suffix = os.path.splitext(name)
+    return stem if suffix.lower() in BED_SUFFIXES else name
+
+
+def read_sources(sources):
+    """Returns [(path, experiment name, description)] for directories and manifest files.
+
+    A directory contributes all its .bed files (plain or compressed) named after the file; a
+    manifest has one tab separated 'path, experiment name[, description]' line per file,
+    with paths relative to the manifest.
+    """
+    entries = []
+    for source in sources:
+        if os.path.isdir(source):
+            for filename in sorted(os.listdir(source)):
+                path = os.path.join(source, filename)
+                if os.path.isfile(path) and strip_compression_suffix(filename).lower().endswith(BED_SUFFIXES):
+                    entries.append((path, experiment_name_of(path), f"bulk load of {path}"))
+            continue
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source) as manifest:
+            for line_number, line in enumerate(manifest, 1):
+                if not line.strip() or line.startswith('#'):
+                    continue
+                parts = line.rstrip('\r\n').split('\t')
+                path = os.path.join(base, parts[0])
+                name = parts[1] if len(parts) > 1 and parts[1] else experiment_name_of(path)
+                description = parts[2] if len(parts) > 2 else f"bulk load of {path}"
+                if not os.path.isfile(path):
+                    raise ValueError(f"{source} line {line_number}: no such file {path}")
+                entries.append((path, name, description))
+    return entries
+
+
+def parse_bed_file(path, experiment_id, loaded_hashes=frozenset()):
+    """Worker process: the SHA-256 of a file and its peaks with their widths and density bins, ready for insert_peaks.
+
+    A file whose hash is in loaded_hashes is not parsed; its peaks, widths and bins are None.
+    """
+    content_hash = hash_file(path)
+    if content_hash in loaded_hashes:
+        return content_hash, None, None, None
+    with open(path, 'rb') as raw:
+        # gzip/bgzip compressed files are decompressed while they are read
+        bed_data = list(iter_bed_rows(open_input(raw), experiment_id))
+    return content_hash, bed_data, max_peak_widths(bed_data), dict(bin_peaks(bed_data))
+
+
+def create_experiments(conn, entries):
+    """Creates an experiment per entry, or reuses the one with that name.
+
+    Returns the experiment ids of the entries and the set of ids that were created.
+    """
+    cur = conn.cursor()
+    ids = []
+    created = set()
+    for _, name, description in entries:
+        cur.execute("SELECT id FROM experiments WHERE experiment_name = ? ORDER BY id LIMIT 1", (name,))
+        row = cur.fetchone()
+        if row is None:
+            cur.execute("INSERT INTO experiments (experiment_name, description) VALUES (?, ?)", (name, description))
+            row = (cur.lastrowid,)
+            created.add(row[0])
+        ids.append(row[0])
+    conn.commit()
+    return ids, created
+
+
+def loaded_hashes(conn):
+    """{experiment_id: set of the SHA-256 of the files loaded into it}"""
+    uploads = {}
+    for experiment_id, content_hash in conn.execute("SELECT experiment_id, sha256 FROM bed_uploads"):
+        uploads.setdefault(experiment_id, set()).add(content_hash)
+    return uploads
+
+
+def iter_parsed_files(tasks, workers):
+    """Parses (path, experiment_id, loaded_hashes) tasks in a process pool, yielding (task, result or exception).
+
+    At most two files per worker are parsed ahead of the writer, which bounds the memory
+    held by parsed but not yet inserted peaks.
+    """
+    tasks = iter(tasks)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while True:
+            while len(running) < 2 * workers:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                running[pool.submit(parse_bed_file, *task)] = task
+            if not running:
+                return
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                try:
+                    yield task, future.result()
+                except Exception as e:
+                    yield task, e
+
+
+def bulk_load(entries, workers=None, keep_indexes=False, log=print):
+    """Loads entries of read_sources; returns (files loaded, peaks loaded, [(path, error)])."""
+    # the Flask module holds the schema helpers; imported here so --help works without PGDATA
+    import flask_app
+
+    workers = workers or os.cpu_count() or 1
+    conn = flask_app.db_pool.acquire()
+    flask_app.ensure_compact_schema(conn)
+    flask_app.ensure_summary_counts(conn)
+    flask_app.ensure_bed_widths(conn)
+    flask_app.ensure_peak_density(conn)
+    flask_app.ensure_bed_uploads(conn)
+    experiment_ids, created = create_experiments(conn, entries)
+    known = loaded_hashes(conn)
+    cur = conn.cursor()
+
+    if not keep_indexes:
+        flask_app.drop_bed_indexes(cur)
+        conn.commit()
+
+    loaded, skipped, peaks, failed = 0, 0, 0, []
+    loaded_ids = set()
+    pending_rows = 0
+    started = time.perf_counter()
+    tasks = [(path, experiment_id, frozenset(known.get(experiment_id, ())))
+             for (path, _, _), experiment_id in zip(entries, experiment_ids)]
+    try:
+        for (path, experiment_id, _), result in iter_parsed_files(tasks, workers):
+            if isinstance(result, Exception):
+                failed.append((path, result))
+                log(f"FAILED {path}: {result}")
+                continue
+            content_hash, bed_data, widths, bins = result
+            # also catches the same file listed twice for an experiment in this run
+            if bed_data is None or content_hash in known.setdefault(experiment_id, set()):
+                skipped += 1
+                log(f"{path}: identical file already loaded into experiment {experiment_id}, skipped")
+                continue
+            flask_app.insert_peaks(cur, experiment_id, bed_data, widths, bins)
+            flask_app.record_upload(cur, experiment_id, content_hash, os.path.basename(path), len(bed_data))
+            known[experiment_id].add(content_hash)
+            loaded_ids.add(experiment_id)
+            loaded += 1
+            peaks += len(bed_data)
+            pending_rows += len(bed_data)
+            log(f"{path}: {len(bed_data)} peaks -> experiment {experiment_id}")
+            if pending_rows >= TRANSACTION_ROWS:
+                flask_app.bump_data_version(cur)
+                conn.commit()
+                pending_rows = 0
+        flask_app.bump_data_version(cur)
+        conn.commit()
+    finally:
+        # also after a failure (dropping its unfinished transaction), so the server is never
+        # left without its indexes
+        conn.rollback()
+        log("building the bed indexes")
+        flask_app.create_bed_indexes(cur)
+        conn.commit()
+
+    # experiments created for files that could not be parsed are removed again
+    cur.executemany("DELETE FROM experiments WHERE id = ?", [(i,) for i in created - loaded_ids])
+    conn.commit()
+    conn.close()
+
+    log("updating the co-occupancy matrix")
+    flask_app.update_cooccupancy()
+    log(f"{loaded} files with {peaks} peaks loaded, {skipped} skipped, in {time.perf_counter() - started:.1f} s")
+    return loaded, peaks, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load many BED files into $PGDATA/genome.db, one experiment per file.")
+    parser.add_argument("sources", nargs="+",
+                        help="directories of .bed/.bed.gz files or manifest files (path<TAB>experiment name[<TAB>description])")
+    parser.add_argument("--pgdata", default=os.getenv("PGDATA"), help="database folder (default: $PGDATA)")
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: all cores)")
+    parser.add_argument("--keep-indexes", action="store_true",
+                        help="insert with the bed indexes in place (faster for a few files into a large database)")
+    args = parser.parse_args(argv)
+
+    if not args.pgdata:
+        parser.error("--pgdata or $PGDATA is required")
+    os.environ["PGDATA"] = args.pgdata
+
+    try:
+        entries = read_sources(args.sources)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if not entries:
+        parser.error("no BED files found")
+
+    _, _, failed = bulk_load(entries, args.workers, args.keep_indexes)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""Sweep line computation of the pairwise peak overlaps between experiments on one chromosome.
+
+Peaks are half-open BED intervals [start, stop) given as (experiment position, start, stop)
+tuples sorted by start; experiment positions are small integers used as bit numbers.
+Only the pairs with at least one experiment in stale_mask (a bit mask of positions) are
+counted, so adding an experiment only costs the pairs it is part of.
+"""
+
+import heapq
+from collections import defaultdict
+
+
+def bits(mask):
+    """The positions of the set bits of mask."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def overlapping_peaks(peaks, stale_mask):
+    """Returns {(a, b): number of peaks of a that overlap at least one peak of b}."""
+    # overlapped[i] is the set of experiments with a peak overlapping peak i, as a bit mask
+    overlapped = [0] * len(peaks)
+    active = []  # (stop, index) of the peaks that may still overlap the next ones
+    for i, (experiment, start, stop) in enumerate(peaks):
+        while active and active[0][0] <= start:
+            heapq.heappop(active)
+        bit = 1 << experiment
+        for _, j in active:
+            other = 1 << peaks[j][0]
+            if (bit | other) & stale_mask:
+                overlapped[i] |= other
+                overlapped[j] |= bit
+        heapq.heappush(active, (stop, i))
+
+    counts = defaultdict(int)
+    for (experiment, _, _), mask in zip(peaks, overlapped):
+        mask &= ~(1 << experiment)
+        if not (1 << experiment) & stale_mask:
+            mask &= stale_mask
+        for other in bits(mask):
+            counts[experiment, other] += 1
+    return counts
+
+
+def merged_intervals(peaks):
+    """Yields the peaks of every experiment merged into non-overlapping (experiment, start, stop)."""
+    current = {}
+    for experiment, start, stop in peaks:
+        interval = current.get(experiment)
+        if interval is None or start > interval[1]:
+            if interval is not None:
+                yield (experiment, interval[0], interval[1])
+            current[experiment] = [start, stop]
+        elif stop > interval[1]:
+            interval[1] = stop
+    for experiment, (start, stop) in current.items():
+        yield (experiment, start, stop)
+
+
+def covered_bases(peaks, stale_mask):
+    """Returns ({a: bases covered by a}, {(a, b): bases covered by both a and b}) with a < b."""
+    events = []
+    for experiment, start, stop in merged_intervals(peaks):
+        events.append((start, 1, experiment))
+        events.append((stop, -1, experiment))
+    events.sort()
+
+    covered = defaultdict(int)
+    shared = defaultdict(int)
+    active = set()
+    active_stale = 0  # the stale experiments in active; nothing is counted while there are none
+    position = None
+    for next_position, change, experiment in events:
+        if active_stale and next_position > position:
+            length = next_position - position
+            for a in active:
+                if (1 << a) & stale_mask:
+                    covered[a] += length
+            if len(active) > 1:
+                ordered = sorted(active)
+                for n, a in enumerate(ordered):
+                    for b in ordered[n + 1:]:
+                        if ((1 << a) | (1 << b)) & stale_mask:
+                            shared[a, b] += length
+        position = next_position
+        stale = (1 << experiment) & stale_mask
+        if change > 0:
+            active.add(experiment)
+            if stale:
+                active_stale += 1
+        else:
+            active.discard(experiment)
+            if stale:
+                active_stale -= 1
+    return covered, shared
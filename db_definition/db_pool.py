@@ -0,0 +1,125 @@
+"""Pool of configured SQLite connections to $PGDATA/genome.db."""
+
+import os
+import sqlite3
+import threading
+
+from metrics import TimedConnection
+
+# Schema used to initialize a new genome.db
+SETUP_SQL_PATH = "/etc/setup_db.sql"
+
+# Set on every new connection. WAL lets the landing page and downloads keep reading
+# while an upload writes; synchronous=NORMAL is durable enough in WAL mode.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=1073741824",   # 1 GB memory mapped reads
+    "PRAGMA cache_size=-65536",      # 64 MB page cache per connection
+    "PRAGMA temp_store=MEMORY",
+)
+
+# Seconds a writer waits for another writer before 'database is locked' is raised
+BUSY_TIMEOUT = 60
+
+# SQLite has a single writer; loaders of this process take this lock around their writes
+# so parallel uploads queue up here instead of running into the busy timeout
+write_lock = threading.Lock()
+
+
+class PooledConnection:
+    """A pooled sqlite3 connection; close() hands it back to the pool instead of closing it.
+
+    Everything else is delegated to the wrapped sqlite3.Connection.
+    """
+
+    def __init__(self, pool, conn, generation):
+        self._pool = pool
+        self._conn = conn
+        self._generation = generation
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    @property
+    def closed(self):
+        return self._conn is None
+
+    def close(self):
+        # Safe to call more than once, e.g. by a helper and again on request teardown
+        if self._conn is not None:
+            self._pool.release(self._conn, self._generation)
+            self._conn = None
+
+
+class ConnectionPool:
+    """Keeps up to max_idle configured connections around for reuse by any thread."""
+
+    def __init__(self, max_idle=8):
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self._db_path = None
+        # bumped whenever the database file is (re)initialized
+        self._generation = 0
+
+    def db_path(self):
+        """Resolves $PGDATA/genome.db once and initializes the database if it does not exist."""
+        if self._db_path is None or not os.path.exists(self._db_path):
+            with self._lock:
+                if self._db_path is not None and os.path.exists(self._db_path):
+                    return self._db_path  # another thread got here first
+                # the database file was removed (see README): drop connections to the old file
+                for conn in self._idle:
+                    conn.close()
+                self._idle = []
+                self._generation += 1
+                self._db_path = self._init_db_path()
+        return self._db_path
+
+    def _init_db_path(self):
+        pgdata_path = os.getenv("PGDATA")
+        # Check if PGDATA exists
+        if not pgdata_path:
+            raise ValueError("PGDATA environment variable is not set!")
+
+        # Check if the PGDATA directory exists
+        if not os.path.exists(pgdata_path):
+            raise ValueError(f"database path is not existsig '{pgdata_path}'!")
+
+        # Define the database file path
+        db_path = os.path.join(pgdata_path, "genome.db")
+        if not os.path.exists(db_path):
+            conn = sqlite3.connect(db_path)
+            with open(SETUP_SQL_PATH, 'r') as file:
+                conn.executescript(file.read())
+            conn.commit()
+            conn.close()
+            print("Database initialized")
+        return db_path
+
+    def _connect(self, db_path):
+        # statement times end up in metrics.SQL_SECONDS
+        conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, check_same_thread=False, factory=TimedConnection)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        db_path = self.db_path()
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+            generation = self._generation
+        if conn is None:
+            conn = self._connect(db_path)
+        return PooledConnection(self, conn, generation)
+
+    def release(self, conn, generation):
+        # Whatever the last user did not commit is dropped, just like on close()
+        conn.rollback()
+        with self._lock:
+            if generation == self._generation and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
@@ -0,0 +1,60 @@
+"""Binned peak density tracks: peaks and summed peak_score per fixed-size genomic bin.
+
+A peak counts for the bin holding its midpoint. The tracks are kept per experiment and
+bin size in the peak_density table and served as bedGraph or in the binary layout of
+pack_density:
+
+    magic b"PKDN", uint32 version (1), uint32 bin size, uint32 number of chromosomes
+    per chromosome: uint16 name length, UTF-8 name, uint32 number of bins, then per bin
+        uint32 bin number, uint32 peaks, float32 summed peak score
+
+All integers and floats are little-endian; bins without peaks are left out.
+"""
+
+import itertools
+import struct
+from collections import defaultdict
+
+# Resolutions the tracks are built for
+DENSITY_BIN_SIZES = (10000, 100000, 1000000)
+
+DENSITY_MAGIC = b"PKDN"
+DENSITY_VERSION = 1
+DENSITY_VALUES = ("peaks", "score")
+
+
+def bin_peaks(bed_rows, bin_sizes=DENSITY_BIN_SIZES):
+    """Counts bed rows (experiment_id, chromosome, start, stop, peak_score, ...) into bins.
+
+    Returns {(experiment_id, bin_size, chromosome, bin): [peaks, summed peak score]}.
+    """
+    bins = defaultdict(lambda: [0, 0.0])
+    for row in bed_rows:
+        experiment_id, chromosome, start, stop, peak_score = row[:5]
+        middle = (start + stop) // 2
+        for bin_size in bin_sizes:
+            entry = bins[experiment_id, bin_size, chromosome, middle // bin_size]
+            entry[0] += 1
+            entry[1] += peak_score or 0.0
+    return bins
+
+
+def iter_bedgraph(rows, bin_size, value, name):
+    """Yields a bedGraph track of rows (chromosome, bin, peaks, score) as UTF-8 lines."""
+    column = DENSITY_VALUES.index(value)
+    yield f'track type=bedGraph name="{name}" description="{value} per {bin_size} bp"\n'.encode("utf-8")
+    for chromosome, bin_number, *values in rows:
+        start = bin_number * bin_size
+        yield f"{chromosome}\t{start}\t{start + bin_size}\t{values[column]}\n".encode("utf-8")
+
+
+def pack_density(rows, bin_size):
+    """Packs rows (chromosome, bin, peaks, score) ordered by chromosome into the binary layout."""
+    chromosomes = []
+    for chromosome, bins in itertools.groupby(rows, key=lambda row: row[0]):
+        bins = list(bins)
+        name = chromosome.encode("utf-8")
+        records = b"".join(struct.pack("<IIf", row[1], row[2], row[3]) for row in bins)
+        chromosomes.append(struct.pack("<H", len(name)) + name + struct.pack("<I", len(bins)) + records)
+    header = DENSITY_MAGIC + struct.pack("<III", DENSITY_VERSION, bin_size, len(chromosomes))
+    return header + b"".join(chromosomes)
@@ -1,12 +1,36 @@
 import os
 import io
-from flask import Flask, url_for, request, redirect, Response, jsonify, render_template
+from flask import Flask, url_for, request, redirect, Response, jsonify, render_template, g, has_app_context
 #import psycopg2
-import sqlite3
 from werkzeug.utils import secure_filename
+from werkzeug.datastructures import FileStorage
+import contextlib
 import csv
+import gzip
 import getpass
 import subprocess
+import uuid
+import threading
+import collections
+import time
+
+from gtf_parser import iter_gtf_batches
+from bed_parser import iter_bed_rows, max_peak_widths
+from input_streams import copy_and_hash, hash_file, open_input, strip_compression_suffix
+from db_pool import ConnectionPool, write_lock
+from jobs import JobQueue, JobSkipped, ProgressReader
+from result_cache import ResultCache, gzip_chunks
+from parallel_annotation import iter_ordered_query_results, start_pool
+from cooccupancy import covered_bases, overlapping_peaks
+from columnar_export import ARROW_AVAILABLE, COLUMNAR_FORMATS, iter_columnar
+import metrics
+from density_tracks import DENSITY_BIN_SIZES, DENSITY_VALUES, bin_peaks, iter_bedgraph, pack_density
+try:
+    import numpy as np
+    from gene_index import GENE_INDEX_DIRNAME, GeneIndex, gene_signature
+except ImportError:
+    # without NumPy the nearby-gene query runs entirely in SQLite on the R*Tree
+    np = None
 
 app = Flask(__name__)
 
@@ -30,36 +54,168 @@ def get_ip():
     return IP
 
 
-# Function to check the file extension
+# Function to check the file extension - gzip/bgzip compressed files (peaks.bed.gz) are accepted too
 def allowed_file(filename):
+    filename = strip_compression_suffix(filename)
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Connections are configured once (WAL, cache and mmap pragmas) and reused across requests
+db_pool = ConnectionPool()
+
+# BED/GTF uploads are loaded by background workers
+ingest_jobs = JobQueue()
+
+
 # Function to create a database connection
 def create_connection():
+    """Returns a pooled connection; close() hands it back to the pool.
+
+    Connections taken inside a request are also handed back on teardown, so early returns
+    and errors can not leak them. Code that outlives the request (streamed responses)
+    has to use db_pool.acquire() directly.
+    """
+    conn = db_pool.acquire()
+    if has_app_context():
+        g.setdefault("db_connections", []).append(conn)
+    return conn
+
+
+@app.teardown_appcontext
+def close_connections(exception):
+    for conn in g.pop("db_connections", []):
+        conn.close()
+
+
+# With PROFILE_REQUESTS=1 requests with ?profile=1 are run under cProfile and dumped to $PGDATA/profiles
+PROFILING_ENABLED = os.getenv("PROFILE_REQUESTS") == "1"
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if PROFILING_ENABLED and request.args.get("profile") == "1":
+        g.profile = metrics.start_profile()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop("request_started", time.perf_counter())
+    profile = g.pop("profile", None)
+    labels = {
+        "route": request.url_rule.rule if request.url_rule else "unmatched",
+        "method": request.method,
+        "status": response.status_code,
+    }
+    profile_path = None
+    if profile is not None:
+        profile_dir = os.path.join(os.path.dirname(db_pool.db_path()), "profiles")
+        os.makedirs(profile_dir, exist_ok=True)
+        profile_path = os.path.join(
+            profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint}-{uuid.uuid4().hex[:8]}.prof")
+        response.headers["X-Profile"] = os.path.basename(profile_path)
+
+    # streamed responses are only done when the server closes them
+    def finished():
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, **labels)
+        if profile is not None:
+            metrics.stop_profile(profile, profile_path)
+
+    response.call_on_close(finished)
+    return response
+
+
+@app.route("/metrics")
+def export_metrics():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+def ensure_summary_counts(conn):
+    """Creates the summary counter tables the landing page reads from.
+
+    They are filled with one full count when they are created (databases from before the
+    counters existed); after that the loaders keep them up to date with add_summary_count
+    and add_experiment_peak_count. summary_counts also holds the 'data_version' counter
+    (see bump_data_version), the random 'database_id' (see get_data_version), the random
+    'gene_load' token (new_gene_load) and 'bed_ids', the highest bed id handed out
+    (allocate_bed_ids).
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'summary_counts'")
+    if cur.fetchone() is None:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS summary_counts (
+                name TEXT PRIMARY KEY,
+                count INT NOT NULL
+            )""")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS experiment_peak_counts (
+                experiment_id INTEGER PRIMARY KEY,
+                peak_count INT NOT NULL
+            )""")
+        cur.execute("""
+            INSERT INTO summary_counts (name, count)
+            SELECT 'genes', count(*) FROM genes
+            UNION ALL SELECT 'transcripts', count(*) FROM transcripts
+            UNION ALL SELECT 'bed_ids', COALESCE(max(id), 0) FROM bed
+        """)
+        cur.execute("INSERT INTO summary_counts (name, count) VALUES ('database_id', ?)", (uuid.uuid4().int >> 66,))
+        new_gene_load(cur)
+        cur.execute("""
+            INSERT INTO experiment_peak_counts (experiment_id, peak_count)
+            SELECT experiment_id, count(*) FROM bed GROUP BY experiment_id
+        """)
+        conn.commit()
+    cur.close()
+
+
+def add_summary_count(cur, name, delta):
+    # Runs in the loader's transaction, so the counter can not drift from the table
+    cur.execute("""
+        INSERT INTO summary_counts (name, count) VALUES (?, ?)
+        ON CONFLICT(name) DO UPDATE SET count = count + excluded.count
+    """, (name, delta))
+
+
+def bump_data_version(cur):
+    # Every load advances the data version, which invalidates all cached results
+    add_summary_count(cur, "data_version", 1)
+
+
+def new_gene_load(cur):
+    # Every change of the genes stores a new random token; the gene index of the old genes
+    # no longer matches it (gene_index.gene_signature)
+    cur.execute("INSERT OR REPLACE INTO summary_counts (name, count) VALUES ('gene_load', ?)",
+                (uuid.uuid4().int >> 66,))
+
+
+def allocate_bed_ids(cur, count):
+    """Reserves count consecutive bed ids and returns the first one.
+
+    bed is a WITHOUT ROWID table, so SQLite does not number its rows. The counter is
+    advanced before it is read, so the loader holds the write lock and no other
+    connection can be handed the same ids.
+    """
+    add_summary_count(cur, "bed_ids", count)
+    cur.execute("SELECT count FROM summary_counts WHERE name = 'bed_ids'")
+    return cur.fetchone()[0] - count + 1
 
-    pgdata_path = os.getenv("PGDATA")
-    # Check if PGDATA exists
-    if not pgdata_path:
-        raise ValueError("PGDATA environment variable is not set!")
-
-    # Check if the PGDATA directory exists
-    if not os.path.exists(pgdata_path):
-        raise ValueError(f"database path is not existsig '{pgdata_path}'!")
-
-    # Define the database file path
-    db_path = os.path.join(pgdata_path, "genome.db")
-    if not os.path.exists(db_path):
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        sql_file_path = "/etc/setup_db.sql"
-        with open(sql_file_path, 'r') as file:
-            sql_script = file.read()
-            cursor.executescript(sql_script)
-        print("Database initialized")
-        return conn
-    else:
-        conn = sqlite3.connect(db_path)
-        return conn
+
+def chromosome_ids(cur, names=()):
+    """Returns {name: id} of the chromosomes dictionary after adding the names not in it yet.
+
+    Rows store the id; loaders translate the chromosome names of their input with this
+    and queries translate ids back by joining chromosomes.
+    """
+    cur.executemany("INSERT OR IGNORE INTO chromosomes (name) VALUES (?)", [(name,) for name in names])
+    cur.execute("SELECT name, id FROM chromosomes")
+    return dict(cur.fetchall())
+
+
+def add_experiment_peak_count(cur, experiment_id, delta):
+    cur.execute("""
+        INSERT INTO experiment_peak_counts (experiment_id, peak_count) VALUES (?, ?)
+        ON CONFLICT(experiment_id) DO UPDATE SET peak_count = peak_count + excluded.peak_count
+    """, (experiment_id, delta))
 
 
 # Route for the default landing page
@@ -74,13 +230,12 @@ def index():
         genome_version_row = cur.fetchone()
         genome_version = genome_version_row[0] if genome_version_row else "Nothing"
 
-        cur.execute("SELECT count(*) FROM genes;")
-
-        gene_counts = cur.fetchone()[0]
-
-        cur.execute("SELECT count(*) FROM transcripts;")
-
-        transcript_counts = cur.fetchone()[0]
+        # Row counts are kept up to date by the loaders instead of being counted on every visit
+        ensure_summary_counts(conn)
+        cur.execute("SELECT name, count FROM summary_counts;")
+        summary_counts = dict(cur.fetchall())
+        gene_counts = summary_counts.get("genes", 0)
+        transcript_counts = summary_counts.get("transcripts", 0)
 
 
         error_message = ""
@@ -89,32 +244,31 @@ def index():
 
 
 
-        # Fetch the number of experiments
-        cur.execute("SELECT COUNT(*) FROM experiments;")
-        num_experiments = cur.fetchone()[0]
-
         # Fetch the number of peaks per experiment
-        cur.execute("""SELECT experiment_id, COUNT(experiment_id)
-            from bed Group By experiment_id """
-        )
+        cur.execute("SELECT experiment_id, peak_count FROM experiment_peak_counts WHERE peak_count > 0;")
         peaks_per_experiment = cur.fetchall()
 
         # Fetch existing experiments
         cur.execute("SELECT id, experiment_name FROM experiments;")
         experiments = cur.fetchall()  # List of tuples (id, experiment_name)
         experiment_dict = {exp_id: exp_name for exp_id, exp_name in experiments}
+        num_experiments = len(experiments)
 
-        print( f"The experiment dict: {experiment_dict}")
         cur.close()
+        # only the cached values: the matrix is updated by the upload jobs
+        cooccupancy = read_cooccupancy(conn)
         conn.close()
 
         # Prepare the data to be displayed
-        peaks_info = {}
+        peaks_info = []
         for exp_id, peak_count in peaks_per_experiment:
             exp_name = experiment_dict.get(exp_id, "Unknown Experiment")
-            peaks_info[exp_name] =  peak_count 
+            peaks_info.append({"id": exp_id, "name": exp_name, "peaks": peak_count})
 
         error_message += request.args.get('error_message', "")  # Get error message from URL
+
+        # Background uploads, newest first
+        jobs = [job.to_dict() for job in ingest_jobs.jobs()]
         
         # Render the landing page with the fetched data
         return render_template(
@@ -125,7 +279,10 @@ def index():
             transcript_counts=transcript_counts,
             peaks_info=peaks_info,
             experiments=[{"id": exp[0], "experiment_name": exp[1]} for exp in experiments],  # Convert tuples to dicts
-            error_message=error_message  # Pass error message to template
+            error_message=error_message,  # Pass error message to template
+            jobs=jobs,
+            jobs_active=ingest_jobs.active(),
+            cooccupancy=cooccupancy
         )
     else:
         return "Database connection error!", 500
@@ -138,6 +295,8 @@ def upload_bed():
     experiment_id = request.form.get("experiment_id")
     new_experiment_name = request.form.get("new_experiment_name")
     new_experiment_description = request.form.get("new_experiment_description")
+    # replace the peaks of the selected experiment instead of adding to them
+    replace = request.form.get("replace") == "1" and not new_experiment_name
 
     
 
@@ -164,202 +323,1246 @@ def upload_bed():
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
 
-        # Process the BED file and insert it into the database
-        result = process_bed_file_in_memory(file, experiment_id)
-        if result:
-            return redirect(url_for('index'))
-            #return jsonify({"success": "BED file uploaded and data inserted into the database"}), 200
-        else:
-            error_message = "error: Failed to process the BED file"
-            return redirect(url_for('index', error_message=error_message))
+        # The file is spooled and loaded in the background; the job shows up on the landing page
+        path, content_hash = spool_upload(file)
+        job = ingest_jobs.submit(
+            "bed", f"{filename} -> experiment {experiment_id}{' (replace)' if replace else ''}", path,
+            ingest_bed_job, experiment_id, filename, content_hash, replace
+        )
+        return job_response(job)
     else:
         error_message = "An error occurred"
         return redirect(url_for('index', error_message=error_message))
 
+@app.route('/delete_experiment', methods=['POST'])
+def delete_experiment_route():
+    """Deletes the experiment experiment_id with all its peaks."""
+    experiment_id = request.form.get("experiment_id", type=int)
+    removed = delete_experiment(experiment_id) if experiment_id is not None else None
+    wants_json = request.accept_mimetypes.best_match(["text/html", "application/json"]) == "application/json"
+    if removed is None:
+        error_message = f"No experiment {request.form.get('experiment_id')}"
+        if wants_json:
+            return jsonify({"error": error_message}), 404
+        return redirect(url_for('index', error_message=error_message))
+    # removed experiments drop out of the co-occupancy matrix
+    update_cooccupancy()
+    if wants_json:
+        return jsonify({"experiment_id": experiment_id, "peaks_removed": removed})
+    return redirect(url_for('index'))
+
 # Function to process the BED file from memory and insert into the database
 def process_bed_file_in_memory(file, experiment_id):
+    try:
+        load_bed_file(file, experiment_id)
+    except ValueError as e:
+        return redirect(url_for('index', error_message=str(e)))
+    return True
+
+def load_bed_file(file, experiment_id, content_hash=None, replace=False):
+    """Parses a BED file (path or upload) and inserts its peaks for experiment_id.
+
+    With replace the current peaks of the experiment are removed in the same transaction.
+    content_hash is the SHA-256 of the file (see input_streams.copy_and_hash): a file
+    already loaded into the experiment is skipped before it is parsed.
+    Returns the number of peaks, or None for a skipped file; raises ValueError with a
+    user facing message on errors.
+    """
     conn = create_connection()
-    if conn:
-        cur = conn.cursor()
+    ensure_compact_schema(conn)
+    ensure_summary_counts(conn)
+    ensure_bed_widths(conn)
+    ensure_peak_density(conn)
+    ensure_cooccupancy_tables(conn)
+    ensure_bed_uploads(conn)
+    cur = conn.cursor()
+    if content_hash is not None and is_duplicate_upload(cur, experiment_id, content_hash, replace):
+        conn.close()
+        return None
 
-        # Open the file (assuming `file` is a path or file-like object)
-        if isinstance(file, str):  # If file is a path
-            with open(file, 'r') as f:
-                lines = f.readlines()
-        else:  # If file is a file-like object (e.g., from Flask request)
-            lines = file.stream
-
-        id_ = 0
-
-        bed_data = []
-
-        for raw_line in lines:
-            id_ +=1
-            line = raw_line.decode("utf-8")  # Decode bytes to str
-            if line.startswith('#'):  # Skip comment lines
-                continue
-            parts = line.strip().split('\t')
-            
-            if len(parts) >= 3:
-                # Extract the necessary columns from the BED file
-                chromosome = parts[0]
-                start = int(parts[1])
-                stop = int(parts[2])
-                peak_score = float(parts[4]) if len(parts) > 4 else 0.0
-                feature_name = parts[3] if len(parts) > 3 else "-"
-                bed_data.append( [ experiment_id, chromosome, start, stop, peak_score, feature_name ] );            
-            else:
-               error_message = f"error on bed file line {id_}" 
-               return redirect(url_for('index', error_message=error_message))
-        try:
-            cur.executemany( 
-                "INSERT INTO bed (experiment_id, chromosome, start, stop, peak_score, feature_name) VALUES (?, ?, ?, ?, ?, ?)", 
-                bed_data
-                )
+    # Open the file (assuming `file` is a path or file-like object)
+    if isinstance(file, str):  # If file is a path
+        source = open(file, 'rb')
+    else:  # If file is a file-like object (e.g., from Flask request)
+        source = contextlib.nullcontext(file.stream)
+
+    parse_started = time.perf_counter()
+    with source as raw:
+        # gzip/bgzip compressed files are decompressed while they are read
+        bed_data = list(iter_bed_rows(open_input(raw), experiment_id))
+    metrics.record_parse("bed", len(bed_data), time.perf_counter() - parse_started)
+    filename = file if isinstance(file, str) else file.filename
+    try:
+        with write_lock:
+            # an identical upload may have been loaded while this one was parsed
+            if content_hash is not None and is_duplicate_upload(cur, experiment_id, content_hash, replace):
+                conn.close()
+                return None
+            cur.execute("SELECT 1 FROM experiments WHERE id = ?", (experiment_id,))
+            if cur.fetchone() is None:
+                raise ValueError(f"experiment {experiment_id} does not exist (any more)")
+            if replace:
+                delete_peaks(cur, experiment_id)
+            insert_peaks(cur, experiment_id, bed_data, max_peak_widths(bed_data), bin_peaks(bed_data))
+            if content_hash is not None:
+                record_upload(cur, experiment_id, content_hash, filename, len(bed_data))
+            bump_data_version(cur)
             conn.commit()
-            conn.close()
-        except Exception as e:
-            return redirect(url_for('index', error_message= f"Line {id_}: Unexpected error: {e}"))
-        return True
-    return False
-
-#-- Table for storing BED data (linking to experiments)
-#CREATE TABLE bed (
-#    id SERIAL PRIMARY KEY,              -- Unique ID for each BED entry
-#    experiment_id INT NOT NULL,         -- Foreign key linking to experiments
-#    chromosome TEXT NOT NULL,           -- Chromosome where the peak is located
-#    start INT NOT NULL,                 -- Start position of the peak
-#    stop INT NOT NULL,                   -- End position of the peak
-#    peak_score FLOAT,                   -- Optional: Peak score or other metric
-#    feature_name TEXT,                  -- Optional: Name of the feature (e.g., TF or region)
-#    FOREIGN KEY (experiment_id) REFERENCES experiments(id)
-#);
-# Function to process the BED file and insert into the database
-def process_bed_file(file_path, experiment_id):
-    conn = create_connection()
-    if conn:
+        conn.close()
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Unexpected error: {e}")
+    return len(bed_data)
+
+def ensure_bed_widths(conn):
+    """Creates bed_widths, the widest peak (stop - start) of every chromosome.
+
+    Together with the (chromosome_id, start) order of bed it turns "peaks overlapping a
+    window" into one sequential range of the table: an overlapping peak starts at most
+    the widest peak before the window. The loaders keep it up to date with add_bed_widths; it is filled with one
+    full scan when it is created for a database from before it existed.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'bed_widths'")
+    if cur.fetchone() is None:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS bed_widths (
+                chromosome_id INTEGER PRIMARY KEY,
+                max_width INT NOT NULL
+            )""")
+        cur.execute("""
+            INSERT OR IGNORE INTO bed_widths (chromosome_id, max_width)
+            SELECT chromosome_id, max(stop - start) FROM bed GROUP BY chromosome_id
+        """)
+        conn.commit()
+    cur.close()
+
+
+def insert_peaks(cur, experiment_id, bed_data, widths, bins):
+    """Inserts the peaks of one experiment and adds them to the tables derived from bed.
+
+    bed_data are rows of bed_parser.iter_bed_rows, widths their max_peak_widths and bins
+    their density_tracks.bin_peaks - computed by the caller, so the bulk loader can do
+    that in its parser processes. All three use chromosome names, which are translated
+    to chromosome ids here. Runs in the caller's transaction.
+    """
+    ids = chromosome_ids(cur, widths)
+    first_id = allocate_bed_ids(cur, len(bed_data))
+    rows = [
+        (ids[row[1]], row[2], first_id + offset, row[0], row[3], row[4], row[5])
+        for offset, row in enumerate(bed_data)
+    ]
+    # inserted in primary key order, each insert lands next to the one before in the bed
+    # B-tree instead of on a random page. The rows only go to the end of the table when
+    # their chromosome range holds no peaks yet (a first load); otherwise they are
+    # interleaved with the peaks already there and fill or split those pages
+    rows.sort()
+    cur.executemany(
+        """INSERT INTO bed (chromosome_id, start, id, experiment_id, stop, peak_score, feature_name)
+        VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        rows)
+    add_bed_widths(cur, {ids[name]: width for name, width in widths.items()})
+    add_peak_density(cur, {
+        (experiment, bin_size, ids[name], bin_number): values
+        for (experiment, bin_size, name, bin_number), values in bins.items()
+    })
+    add_experiment_peak_count(cur, experiment_id, len(bed_data))
+
+
+def add_bed_widths(cur, widths):
+    # widths is {chromosome id: widest peak} of the new peaks
+    cur.executemany("""
+        INSERT INTO bed_widths (chromosome_id, max_width) VALUES (?, ?)
+        ON CONFLICT(chromosome_id) DO UPDATE SET max_width = max(max_width, excluded.max_width)
+    """, widths.items())
+
+
+def ensure_peak_density(conn):
+    """Creates peak_density, the binned peak density tracks of every experiment.
+
+    For each experiment, bin size of DENSITY_BIN_SIZES and bin it holds the peaks with
+    their midpoint in the bin and their summed peak_score. The loaders add to it with
+    add_peak_density; it is filled from the bed table when it is created for a database
+    from before it existed.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'peak_density'")
+    if cur.fetchone() is None:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS peak_density (
+                experiment_id INT NOT NULL,
+                bin_size INT NOT NULL,
+                chromosome_id INT NOT NULL,
+                bin INT NOT NULL,
+                peaks INT NOT NULL,
+                score_sum REAL NOT NULL,
+                PRIMARY KEY (experiment_id, bin_size, chromosome_id, bin)
+            ) WITHOUT ROWID""")
+        for bin_size in DENSITY_BIN_SIZES:
+            cur.execute("""
+                INSERT OR IGNORE INTO peak_density (experiment_id, bin_size, chromosome_id, bin, peaks, score_sum)
+                SELECT experiment_id, ?, chromosome_id, ((start + stop) / 2) / ?, count(*), total(peak_score)
+                FROM bed GROUP BY experiment_id, chromosome_id, ((start + stop) / 2) / ?
+            """, (bin_size, bin_size, bin_size))
+        conn.commit()
+    cur.close()
+
+
+def add_peak_density(cur, bins):
+    # bins of the new peaks (density_tracks.bin_peaks with chromosome ids) - only these are touched
+    cur.executemany("""
+        INSERT INTO peak_density (experiment_id, bin_size, chromosome_id, bin, peaks, score_sum)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(experiment_id, bin_size, chromosome_id, bin)
+        DO UPDATE SET peaks = peaks + excluded.peaks, score_sum = score_sum + excluded.score_sum
+    """, [key + tuple(values) for key, values in bins.items()])
+
+
+def ensure_bed_uploads(conn):
+    """Creates bed_uploads, the SHA-256 of every BED file loaded into an experiment.
+
+    An upload whose hash is recorded for its experiment is skipped. Peaks loaded before
+    the table existed have no entry, so their files are loaded once more if uploaded again.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'bed_uploads'")
+    if cur.fetchone() is None:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS bed_uploads (
+                experiment_id INT NOT NULL,
+                sha256 TEXT NOT NULL,
+                filename TEXT,
+                peak_count INT NOT NULL,
+                PRIMARY KEY (experiment_id, sha256)
+            ) WITHOUT ROWID""")
+        conn.commit()
+    cur.close()
+
+
+def is_duplicate_upload(cur, experiment_id, content_hash, replace=False):
+    """True if loading the file with content_hash would not change the experiment.
+
+    Added to an experiment, that is the case when the file is already loaded into it; as
+    a replacement, when the file is all the experiment holds.
+    """
+    cur.execute("SELECT sha256, peak_count FROM bed_uploads WHERE experiment_id = ?", (experiment_id,))
+    uploads = dict(cur.fetchall())
+    if not replace:
+        return content_hash in uploads
+    if set(uploads) != {content_hash}:
+        return False
+    cur.execute("SELECT peak_count FROM experiment_peak_counts WHERE experiment_id = ?", (experiment_id,))
+    row = cur.fetchone()
+    return row is not None and row[0] == uploads[content_hash]
+
+
+def record_upload(cur, experiment_id, content_hash, filename, peak_count):
+    cur.execute("INSERT OR REPLACE INTO bed_uploads VALUES (?, ?, ?, ?)",
+                (experiment_id, content_hash, filename, peak_count))
+
+
+def delete_peaks(cur, experiment_id):
+    """Removes the peaks of one experiment and takes them out of the tables derived from bed.
+
+    Only rows of the experiment are touched: its peaks through idx_bed_experiment, its
+    density bins as one range of the peak_density primary key. Its co-occupancy values are
+    dropped, so update_cooccupancy computes them again if peaks are added back. bed_widths
+    is kept: a widest peak that is gone only makes region queries read a few more rows.
+    Runs in the caller's transaction; returns the number of peaks removed.
+    """
+    cur.execute("DELETE FROM bed WHERE experiment_id = ?", (experiment_id,))
+    removed = cur.rowcount
+    cur.execute("DELETE FROM peak_density WHERE experiment_id = ?", (experiment_id,))
+    cur.execute("DELETE FROM experiment_peak_counts WHERE experiment_id = ?", (experiment_id,))
+    cur.execute("DELETE FROM experiment_coverage WHERE experiment_id = ?", (experiment_id,))
+    cur.execute("DELETE FROM cooccupancy WHERE experiment_a = ? OR experiment_b = ?", (experiment_id, experiment_id))
+    cur.execute("DELETE FROM bed_uploads WHERE experiment_id = ?", (experiment_id,))
+    return removed
+
+
+def delete_experiment(experiment_id):
+    """Deletes an experiment with its peaks; returns the number of peaks removed or None if it does not exist."""
+    conn = db_pool.acquire()
+    try:
+        ensure_compact_schema(conn)
+        ensure_summary_counts(conn)
+        ensure_peak_density(conn)
+        ensure_cooccupancy_tables(conn)
+        ensure_bed_uploads(conn)
         cur = conn.cursor()
+        with write_lock:
+            cur.execute("SELECT 1 FROM experiments WHERE id = ?", (experiment_id,))
+            if cur.fetchone() is None:
+                return None
+            removed = delete_peaks(cur, experiment_id)
+            cur.execute("DELETE FROM experiments WHERE id = ?", (experiment_id,))
+            bump_data_version(cur)
+            conn.commit()
+        cur.close()
+        return removed
+    finally:
+        conn.close()
+
 
-        with open(file_path, 'r') as bed_file:
-            for line in bed_file:
-                if line.startswith('#'):  # Skip comment lines
-                    continue
-                parts = line.strip().split('\t')
-                if len(parts) >= 3:
-                    # Extract the necessary columns from the BED file
-                    chromosome = parts[0]
-                    start = int(parts[1])
-                    end = int(parts[2])
-                    peak_score = float(parts[4]) if len(parts) > 4 else None
-                    feature_name = parts[3] if len(parts) > 3 else None
-
-                    # Insert the data into the database
-                    cur.execute("""
-                        INSERT INTO bed (experiment_id, chromosome, start, end, peak_score, feature_name)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, (experiment_id, chromosome, start, end, peak_score, feature_name))
+# Indexes the peak filters of the nearby-gene query are served from. Position lookups need
+# none: bed is ordered by (chromosome_id, start), and as bed is a WITHOUT ROWID table
+# these indexes end with those columns too, so idx_bed_experiment is in effect on
+# (experiment_id, chromosome_id, start). They are created with the schema (setup_db.sql),
+# by its upgrade and at the end of a bulk load, never on a read: a bulk load drops them
+# while it runs, and the queries stay correct without them.
+BED_INDEXES = (
+    ("idx_bed_experiment", "experiment_id"),
+    ("idx_bed_peak_score", "peak_score"),
+)
 
+
+def create_bed_indexes(cur):
+    # also at server start: restores the indexes of a bulk load that was killed before
+    # it could build them
+    for name, columns in BED_INDEXES:
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON bed({columns})")
+
+
+def drop_bed_indexes(cur):
+    # bulk loads insert without the indexes and build them once at the end
+    for name, _ in BED_INDEXES:
+        cur.execute(f"DROP INDEX IF EXISTS {name}")
+
+# Function to process the BED file and insert into the database
+def process_bed_file(file_path, experiment_id):
+    """Loads the BED file at file_path (plain or gzip compressed) for experiment_id.
+
+    A file already loaded into the experiment is skipped. Many files are better loaded
+    with bulk_load_bed.py.
+    """
+    load_bed_file(file_path, experiment_id, hash_file(file_path))
+    return True
+
+def build_gene_interval_index(cur):
+    """(Re)builds the R*Tree interval index over the genes table.
+
+    Every gene is stored as a box [min(start, stop), max(start, stop)] on its chromosome id,
+    so a peak window lookup costs O(log G + hits) instead of a scan over the whole chromosome.
+    """
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS genes_rtree USING rtree_i32(
+            id, chrom_min, chrom_max, start, stop
+        )""")
+    cur.execute("DELETE FROM genes_rtree")
+    cur.execute("""
+        INSERT INTO genes_rtree (id, chrom_min, chrom_max, start, stop)
+        SELECT id, chromosome_id, chromosome_id, min(start, stop), max(start, stop) FROM genes
+    """)
+
+
+def ensure_gene_interval_index(conn):
+    # Databases created before the interval index existed get it built on first use
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'genes_rtree'")
+    if cur.fetchone() is None:
+        build_gene_interval_index(cur)
         conn.commit()
+    cur.close()
+
+
+def ensure_strand_columns(conn):
+    """Upgrades databases loaded before the strand and the TSS were stored.
+
+    Minus strand genes and transcripts were stored with start and stop swapped; they get
+    start <= stop back, the strand is taken from the swap (transcripts inherit the strand
+    of their gene) and every transcript its chromosome and TSS.
+    """
+    cur = conn.cursor()
+    cur.execute("PRAGMA table_info(transcripts)")
+    if "tss" in [column[1] for column in cur.fetchall()]:
+        cur.close()
+        return
+    ensure_summary_counts(conn)
+    with write_lock:
+        cur.execute("PRAGMA table_info(transcripts)")
+        if "tss" not in [column[1] for column in cur.fetchall()]:
+            cur.execute("ALTER TABLE genes ADD COLUMN strand TEXT")
+            for column in ("chromosome TEXT", "strand TEXT", "tss INT"):
+                cur.execute(f"ALTER TABLE transcripts ADD COLUMN {column}")
+            # all expressions of an UPDATE see the old row, so the swap needs no temporary
+            cur.execute("""
+                UPDATE genes SET
+                    strand = CASE WHEN start > stop THEN '-' ELSE '+' END,
+                    start = min(start, stop),
+                    stop = max(start, stop)
+            """)
+            cur.execute("""
+                UPDATE transcripts SET
+                    chromosome = (SELECT g.chromosome FROM genes g WHERE g.id = transcripts.gene_id),
+                    strand = (SELECT g.strand FROM genes g WHERE g.id = transcripts.gene_id),
+                    start = min(start, stop),
+                    stop = max(start, stop)
+            """)
+            cur.execute("UPDATE transcripts SET tss = CASE strand WHEN '-' THEN stop ELSE start END")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_transcripts_chromosome_tss ON transcripts(chromosome, tss)")
+            new_gene_load(cur)
+            bump_data_version(cur)
+            conn.commit()
+    cur.close()
+
+
+def ensure_compact_schema(conn):
+    """Upgrades databases that store the chromosome name on every bed, genes and transcripts row.
+
+    The names move into the chromosomes dictionary and the rows get its integer id; bed
+    becomes a WITHOUT ROWID table clustered by (chromosome_id, start, id) and the
+    AUTOINCREMENT of all tables is dropped (see setup_db.sql). Ids are kept, so links
+    between the tables, cached results and downloads stay the same. The tables derived
+    from bed are rebuilt on their next use; the database is vacuumed to give the space back.
+    """
+    ensure_strand_columns(conn)
+    cur = conn.cursor()
+    cur.execute("PRAGMA table_info(bed)")
+    if "chromosome_id" in [column[1] for column in cur.fetchall()]:
+        cur.close()
+        return
+    ensure_summary_counts(conn)
+    with write_lock:
+        cur.execute("PRAGMA table_info(bed)")
+        if "chromosome_id" not in [column[1] for column in cur.fetchall()]:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS chromosomes (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE
+                )""")
+            # new names in sorted order, so chromosome ids of these databases follow the names
+            cur.execute("""
+                INSERT OR IGNORE INTO chromosomes (name)
+                SELECT chromosome FROM genes UNION SELECT chromosome FROM bed ORDER BY 1
+            """)
+            rebuilds = (
+                ("experiments", """
+                    CREATE TABLE experiments_compact (
+                        id INTEGER PRIMARY KEY,
+                        experiment_name TEXT NOT NULL,
+                        description TEXT
+                    )""", """
+                    INSERT INTO experiments_compact (id, experiment_name, description)
+                    SELECT id, experiment_name, description FROM experiments"""),
+                ("info", """
+                    CREATE TABLE info_compact (
+                        id INTEGER PRIMARY KEY,
+                        info TEXT
+                    )""", """
+                    INSERT INTO info_compact (id, info) SELECT id, info FROM info"""),
+                ("genes", """
+                    CREATE TABLE genes_compact (
+                        id INTEGER PRIMARY KEY,
+                        gene_name TEXT NOT NULL,
+                        chromosome_id INT NOT NULL,
+                        start INT,
+                        stop INT,
+                        strand TEXT
+                    )""", """
+                    INSERT INTO genes_compact (id, gene_name, chromosome_id, start, stop, strand)
+                    SELECT g.id, g.gene_name, c.id, g.start, g.stop, g.strand
+                    FROM genes g JOIN chromosomes c ON c.name = g.chromosome"""),
+                ("transcripts", """
+                    CREATE TABLE transcripts_compact (
+                        id INTEGER PRIMARY KEY,
+                        gene_id INT NOT NULL,
+                        transcript_name TEXT NOT NULL,
+                        chromosome_id INT,
+                        start INT,
+                        stop INT,
+                        strand TEXT,
+                        tss INT,
+                        FOREIGN KEY (gene_id) REFERENCES genes(id)
+                    )""", """
+                    INSERT INTO transcripts_compact (id, gene_id, transcript_name, chromosome_id, start, stop, strand, tss)
+                    SELECT t.id, t.gene_id, t.transcript_name, c.id, t.start, t.stop, t.strand, t.tss
+                    FROM transcripts t LEFT JOIN chromosomes c ON c.name = t.chromosome"""),
+                ("bed", """
+                    CREATE TABLE bed_compact (
+                        chromosome_id INT NOT NULL,
+                        start INT NOT NULL,
+                        id INT NOT NULL,
+                        experiment_id INT NOT NULL,
+                        stop INT NOT NULL,
+                        peak_score FLOAT,
+                        feature_name TEXT,
+                        PRIMARY KEY (chromosome_id, start, id),
+                        FOREIGN KEY (experiment_id) REFERENCES experiments(id)
+                    ) WITHOUT ROWID""", """
+                    INSERT INTO bed_compact (chromosome_id, start, id, experiment_id, stop, peak_score, feature_name)
+                    SELECT c.id, b.start, b.id, b.experiment_id, b.stop, b.peak_score, b.feature_name
+                    FROM bed b JOIN chromosomes c ON c.name = b.chromosome
+                    ORDER BY c.id, b.start, b.id"""),
+            )
+            for table, create, copy in rebuilds:
+                cur.execute(create)
+                cur.execute(copy)
+                # the indexes of the old table are dropped with it and created again below
+                cur.execute(f"DROP TABLE {table}")
+                cur.execute(f"ALTER TABLE {table}_compact RENAME TO {table}")
+            cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'")
+            if cur.fetchone() is not None:
+                cur.execute("DELETE FROM sqlite_sequence")
+
+            # keyed by chromosome name; filled again from bed by ensure_bed_widths/ensure_peak_density
+            cur.execute("DROP TABLE IF EXISTS bed_widths")
+            cur.execute("DROP TABLE IF EXISTS peak_density")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_genes_chromosome_start ON genes(chromosome_id, start)")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_transcripts_gene_id ON transcripts(gene_id)")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_transcripts_chromosome_tss ON transcripts(chromosome_id, tss)")
+            create_bed_indexes(cur)
+            build_gene_interval_index(cur)
+            cur.execute("""
+                INSERT INTO summary_counts (name, count) SELECT 'bed_ids', COALESCE(max(id), 0) FROM bed WHERE true
+                ON CONFLICT(name) DO UPDATE SET count = excluded.count
+            """)
+            bump_data_version(cur)
+            conn.commit()
+            cur.execute("VACUUM")
+    ensure_bed_widths(conn)
+    ensure_peak_density(conn)
+    cur.close()
+
+
+# Number of rows pulled from the cursor at a time when streaming query results
+FETCH_CHUNK_SIZE = 10000
+
+# Runs once per chromosome (see iter_annotation_query). CROSS JOIN keeps the genes as the
+# outer loop, read in idx_genes_chromosome_start order, so the rows come out in ORDER BY
+# order without a sort and stream from the first gene on. Each gene reads the peaks of
+# its window widened by distance as one range of the (chromosome_id, start, id) key of bed:
+# an overlapping peak starts at most the widest peak of the chromosome (bed_widths) before
+# the window. The rows and distances are exactly those of the plain join in the README.
+# Parameters: distance + widest peak, distance, chromosome_id, distance, peak filters.
+GENES_NEAR_PEAKS_QUERY = """
+    SELECT
+        g.id AS gene_id,
+        g.gene_name,
+        c.name AS chromosome,
+        g.start AS gene_start,
+        g.stop AS gene_stop,
+        b.id AS bed_id,
+        e.experiment_name,
+        c.name AS bed_chromosome,
+        b.start AS bed_start,
+        b.stop AS bed_stop,
+        b.peak_score,
+        b.feature_name,
+        CASE
+            -- Gene is to the right of the peak
+            WHEN g.start > b.stop THEN g.start - b.stop
+            -- Gene is to the left of the peak
+            WHEN g.stop < b.start THEN b.start - g.stop
+            -- Gene overlaps the peak
+            ELSE 0
+        END AS distance
+    FROM genes g
+    CROSS JOIN bed b
+        ON b.chromosome_id = g.chromosome_id
+        AND b.start >= g.start - ? AND b.start <= g.stop + ?
+    JOIN chromosomes c ON c.id = g.chromosome_id
+    JOIN experiments e ON b.experiment_id = e.id
+    WHERE g.chromosome_id = ? AND b.stop >= g.start - ?{peak_filter}
+    ORDER BY g.start, g.id, b.start, b.id;
+"""
+
+GENES_NEAR_PEAKS_HEADER = [
+    "Gene ID", "Gene Name", "Chromosome", "Gene Start", "Gene Stop", "BED ID",
+    "Experiment ID", "BED Chromosome", "BED Start", "BED Stop", "Peak Score",
+    "Feature Name", "Distance (bp)"
+]
+
+# Column types of the Arrow/Parquet downloads (see columnar_export.arrow_type)
+GENES_NEAR_PEAKS_TYPES = [
+    "int", "category", "category", "int", "int", "int",
+    "category", "category", "int", "int", "float",
+    "str", "int"
+]
+
+
+# TSS mode: each peak is matched to the transcription start sites within distance of it.
+# Like GENES_NEAR_PEAKS_QUERY it runs per chromosome with the transcripts as the outer loop
+# in idx_transcripts_chromosome_tss order, so no sort is needed. Per peak and gene only the
+# transcript with the TSS closest to the peak is kept (the lowest transcript id on ties):
+# the NOT EXISTS looks for a closer transcript of the same gene through idx_transcripts_gene_id.
+# The distance is signed along the transcript: negative = peak upstream of the TSS,
+# positive = downstream, 0 = the peak covers the TSS.
+# Parameters: distance + widest peak, distance, chromosome_id, distance, peak filters.
+TSS_NEAR_PEAKS_QUERY = """
+    SELECT
+        g.id AS gene_id,
+        g.gene_name,
+        c.name AS chromosome,
+        t.strand,
+        t.transcript_name,
+        t.tss,
+        b.id AS bed_id,
+        e.experiment_name,
+        b.start AS bed_start,
+        b.stop AS bed_stop,
+        b.peak_score,
+        b.feature_name,
+        CASE
+            WHEN b.stop < t.tss THEN b.stop - t.tss
+            WHEN b.start > t.tss THEN b.start - t.tss
+            ELSE 0
+        END * CASE t.strand WHEN '-' THEN -1 ELSE 1 END AS distance
+    FROM transcripts t
+    CROSS JOIN bed b
+        ON b.chromosome_id = t.chromosome_id
+        AND b.start >= t.tss - ? AND b.start <= t.tss + ?
+    JOIN genes g ON g.id = t.gene_id
+    JOIN chromosomes c ON c.id = t.chromosome_id
+    JOIN experiments e ON b.experiment_id = e.id
+    WHERE t.chromosome_id = ? AND b.stop >= t.tss - ?{peak_filter}
+      AND NOT EXISTS (
+        SELECT 1 FROM transcripts o
+        WHERE o.gene_id = t.gene_id AND o.id != t.id
+          AND (max(o.tss - b.stop, b.start - o.tss, 0) < max(t.tss - b.stop, b.start - t.tss, 0)
+               OR (max(o.tss - b.stop, b.start - o.tss, 0) = max(t.tss - b.stop, b.start - t.tss, 0)
+                   AND o.id < t.id))
+      )
+    ORDER BY t.tss;
+"""
+
+TSS_NEAR_PEAKS_HEADER = [
+    "Gene ID", "Gene Name", "Chromosome", "Strand", "Transcript", "TSS", "BED ID",
+    "Experiment ID", "BED Start", "BED Stop", "Peak Score", "Feature Name",
+    "Distance to TSS (bp)"
+]
+
+TSS_NEAR_PEAKS_TYPES = [
+    "int", "category", "category", "category", "str", "int", "int",
+    "category", "int", "int", "float", "str",
+    "int"
+]
+
+
+def parse_region(region):
+    """Parses 'chr6' or 'chr6:70,000,000-71,000,000' into (chromosome, start, stop).
+
+    start and stop are None if only a chromosome is given.
+    """
+    region = region.strip().replace(",", "")
+    if ":" not in region:
+        return region, None, None
+    chromosome, span = region.rsplit(":", 1)
+    start, stop = span.split("-")
+    return chromosome, int(start), int(stop)
+
+
+def peak_filter_clause(experiment_ids=None, chromosome=None, start=None, stop=None, min_score=None):
+    """Builds the SQL conditions (and their parameters) restricting the bed rows of a query.
+
+    The conditions only use columns of bed b, so SQLite applies them in the outer loop
+    through the (chromosome_id, start) order of bed, idx_bed_experiment or idx_bed_peak_score,
+    before any gene is probed. The chromosome name is translated by a constant subquery.
+    """
+    clauses = []
+    params = []
+    if experiment_ids:
+        clauses.append(f"b.experiment_id IN ({', '.join('?' * len(experiment_ids))})")
+        params.extend(int(exp_id) for exp_id in experiment_ids)
+    if chromosome:
+        clauses.append("b.chromosome_id = (SELECT id FROM chromosomes WHERE name = ?)")
+        params.append(chromosome)
+    if start is not None:
+        clauses.append("b.stop >= ?")
+        params.append(start)
+    if stop is not None:
+        clauses.append("b.start <= ?")
+        params.append(stop)
+    if min_score is not None:
+        clauses.append("b.peak_score >= ?")
+        params.append(min_score)
+    return "".join(f"\n      AND {clause}" for clause in clauses), params
+
+
+# In-memory GeneIndex of the current genes table, shared by all requests of this process
+_gene_index = None
+_gene_index_lock = threading.Lock()
+
+
+def gene_index_path():
+    return os.path.join(os.path.dirname(db_pool.db_path()), GENE_INDEX_DIRNAME)
+
+
+def get_gene_index(conn):
+    """Returns the GeneIndex of the genes table behind conn.
+
+    The copy in memory is reused as long as the gene load token has not changed, then
+    the memory-mapped directory next to genome.db is tried; only if that is outdated too
+    the index is rebuilt from the table and saved for the next process.
+    """
+    global _gene_index
+    ensure_summary_counts(conn)
+    signature = gene_signature(conn)
+    if not signature[1]:
+        # loaded before the token existed: give these genes one
+        with write_lock:
+            cur = conn.cursor()
+            cur.execute("SELECT 1 FROM summary_counts WHERE name = 'gene_load'")
+            if cur.fetchone() is None:
+                new_gene_load(cur)
+                conn.commit()
+            cur.close()
+        signature = gene_signature(conn)
+    with _gene_index_lock:
+        if _gene_index is None or _gene_index.signature != signature:
+            path = gene_index_path()
+            index = GeneIndex.load(path)
+            if index is None or index.signature != signature:
+                index = GeneIndex.from_connection(conn)
+                index.save(path)
+            _gene_index = index
+        return _gene_index
+
+
+# The primary key order of bed, so the peaks of a chromosome are read sequentially and sorted
+PEAKS_ON_CHROMOSOME_QUERY = """
+    SELECT b.id, e.experiment_name, b.start, b.stop, b.peak_score, b.feature_name
+    FROM bed b
+    JOIN experiments e ON b.experiment_id = e.id
+    WHERE b.chromosome_id = ?{peak_filter}
+    ORDER BY b.start, b.id;
+"""
+
+
+def iter_peaks_by_chromosome(cur, index, **filters):
+    """Yields (chromosome, peak rows, peak starts, peak stops) for the chromosomes of index.
+
+    The peak rows are those of PEAKS_ON_CHROMOSOME_QUERY sorted by start, the starts and
+    stops the matching NumPy arrays. Chromosomes without peaks are skipped.
+    """
+    peak_filter, filter_params = peak_filter_clause(**filters)
+    query = PEAKS_ON_CHROMOSOME_QUERY.format(peak_filter=peak_filter)
+    ids = chromosome_ids(cur)
+    chromosomes = [name for name in index.chromosome_list() if name in ids]
+    if filters.get("chromosome"):
+        chromosomes = [name for name in chromosomes if name == filters["chromosome"]]
+    for chromosome in chromosomes:
+        cur.execute(query, [ids[chromosome]] + filter_params)
+        peaks = cur.fetchall()
+        if not peaks:
+            continue
+        yield (chromosome, peaks, np.array([peak[2] for peak in peaks], dtype=np.int64),
+               np.array([peak[3] for peak in peaks], dtype=np.int64))
+
+
+def annotation_chromosomes(cur, chromosome=None):
+    """[(chromosome_id, widest peak)] of the chromosomes with peaks, ordered by name.
+
+    The nearby-gene queries run once per chromosome in this order, which is the
+    chromosome order of their downloads.
+    """
+    query = """SELECT w.chromosome_id, w.max_width FROM bed_widths w
+        JOIN chromosomes c ON c.id = w.chromosome_id"""
+    params = []
+    if chromosome:
+        query += " WHERE c.name = ?"
+        params.append(chromosome)
+    cur.execute(query + " ORDER BY c.name", params)
+    return cur.fetchall()
+
+
+def iter_annotation_query(query, distance, chunk_size=FETCH_CHUNK_SIZE, **filters):
+    """Runs GENES_NEAR_PEAKS_QUERY or TSS_NEAR_PEAKS_QUERY chromosome by chromosome.
+
+    Yields the rows in lists of at most chunk_size rows, as they are produced.
+    """
+    peak_filter, filter_params = peak_filter_clause(**filters)
+    query = query.format(peak_filter=peak_filter)
+    conn = db_pool.acquire()
+    try:
+        ensure_compact_schema(conn)
+        cur = conn.cursor()
+        for chromosome_id, max_width in annotation_chromosomes(cur, filters.get("chromosome")):
+            cur.execute(query, [distance + max_width, distance, chromosome_id, distance] + filter_params)
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
         cur.close()
+    finally:
         conn.close()
-        return True
-    return False
 
-# Function to check if the file is a valid BED file
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'bed'}
 
+def iter_tss_near_peaks(distance, chunk_size=FETCH_CHUNK_SIZE, **filters):
+    """Runs the TSS mode query and yields the result in lists of at most chunk_size rows."""
+    return iter_annotation_query(TSS_NEAR_PEAKS_QUERY, distance, chunk_size, **filters)
 
-def get_genes_near_peaks(distance):
-    # Connect to the SQLite database
-    conn = create_connection()  # Make sure to provide the path to your database
-    if conn:
+
+def iter_genes_near_peaks(distance, chunk_size=FETCH_CHUNK_SIZE, **filters):
+    """Runs the nearby-gene query and yields the result in lists of at most chunk_size rows.
+
+    With NumPy the genes come from the in-memory GeneIndex and only the peaks are read
+    from SQLite, one chromosome at a time; otherwise see iter_genes_near_peaks_sql.
+
+    filters are the keyword arguments of peak_filter_clause.
+    The connection stays open until the generator is exhausted or closed.
+    """
+    if np is None:
+        yield from iter_genes_near_peaks_sql(distance, chunk_size, **filters)
+        return
+
+    # not bound to the request: the generator keeps reading after the view has returned
+    conn = db_pool.acquire()
+    try:
+        ensure_compact_schema(conn)
+        index = get_gene_index(conn)
         cur = conn.cursor()
-        try:
-            # Define the SQL query
-            query = """
-                SELECT
-                    g.id AS gene_id,
-                    g.gene_name,
-                    g.chromosome,
-                    g.start AS gene_start,
-                    g.stop AS gene_stop,
-                    b.id AS bed_id,
-                    e.experiment_name,
-                    b.chromosome AS bed_chromosome,
-                    b.start AS bed_start,
-                    b.stop AS bed_stop,
-                    b.peak_score,
-                    b.feature_name,
-                    CASE
-                        -- Gene is to the right of the peak
-                        WHEN g.start > b.stop THEN g.start - b.stop
-                        -- Gene is to the left of the peak
-                        WHEN g.stop < b.start THEN b.start - g.stop
-                        -- Gene overlaps the peak
-                        ELSE 0
-                    END AS distance
-                FROM genes g
-                JOIN bed b ON g.chromosome = b.chromosome
-                JOIN experiments e ON b.experiment_id = e.id
-                WHERE (g.start - ? <= b.stop AND g.stop + ? >= b.start)
-                ORDER BY g.chromosome, g.start;
-            """
-            # Execute the query with the provided distance as a parameter
-            cur.execute(query, (distance, distance))
-
-            # Fetch all results
-            results = cur.fetchall()
-
-            # Close the cursor and connection
-            cur.close()
-            conn.close()
+        for chromosome, peaks, peak_starts, peak_stops in iter_peaks_by_chromosome(cur, index, **filters):
+            peak_rows, gene_rows = index.window_matches(chromosome, peak_starts, peak_stops, distance)
+
+            for offset in range(0, len(gene_rows), chunk_size):
+                peak_part = peak_rows[offset:offset + chunk_size]
+                gene_part = gene_rows[offset:offset + chunk_size]
+                gene_starts = index.starts[gene_part]
+                gene_stops = index.stops[gene_part]
+                starts, stops = peak_starts[peak_part], peak_stops[peak_part]
+                # same CASE as in GENES_NEAR_PEAKS_QUERY
+                distances = np.where(gene_starts > stops, gene_starts - stops,
+                                     np.where(gene_stops < starts, starts - gene_stops, 0))
+                yield [
+                    (gene_id, gene_name, chromosome, gene_start, gene_stop, bed[0], bed[1], chromosome,
+                     bed[2], bed[3], bed[4], bed[5], gap)
+                    for gene_id, gene_name, gene_start, gene_stop, bed, gap in zip(
+                        index.ids[gene_part].tolist(),
+                        index.names[index.name_codes[gene_part]].tolist(),
+                        gene_starts.tolist(),
+                        gene_stops.tolist(),
+                        (peaks[position] for position in peak_part.tolist()),
+                        distances.tolist()
+                    )
+                ]
+        cur.close()
+    finally:
+        conn.close()
 
-            return results
-        except Exception as e:
-            print(f"Error executing query: {e}")
-            return None
-    else:
+
+NEAREST_GENES_HEADER = [
+    "BED ID", "Experiment ID", "BED Chromosome", "BED Start", "BED Stop", "Peak Score",
+    "Feature Name", "Rank", "Gene ID", "Gene Name", "Strand", "Gene Start", "Gene Stop",
+    "Distance (bp)"
+]
+
+NEAREST_GENES_TYPES = [
+    "int", "category", "category", "int", "int", "float",
+    "str", "int", "int", "category", "category", "int", "int",
+    "int"
+]
+
+NEAREST_TSS_HEADER = [
+    "BED ID", "Experiment ID", "BED Chromosome", "BED Start", "BED Stop", "Peak Score",
+    "Feature Name", "Rank", "Gene ID", "Gene Name", "Strand", "Transcript", "TSS",
+    "Distance to TSS (bp)"
+]
+
+NEAREST_TSS_TYPES = [
+    "int", "category", "category", "int", "int", "float",
+    "str", "int", "int", "category", "category", "str", "int",
+    "int"
+]
+
+# Upper limit for k, keeps the size of a nearest gene download predictable
+MAX_NEAREST_GENES = 100
+
+
+def iter_nearest_genes(k, mode="gene", chunk_size=FETCH_CHUNK_SIZE, **filters):
+    """Yields the k nearest genes of every peak in lists of at most chunk_size rows.
+
+    mode 'gene' measures the distance to the gene bodies (0 for overlaps), mode 'tss'
+    to the closest TSS of each gene, signed along the transcript like the TSS mode of
+    /get_genes. Rows are ordered by chromosome, peak start and rank. Needs NumPy.
+    """
+    if np is None:
+        raise RuntimeError("the nearest gene search needs NumPy")
+    conn = db_pool.acquire()
+    try:
+        ensure_compact_schema(conn)
+        index = get_gene_index(conn)
+        cur = conn.cursor()
+        for chromosome, peaks, peak_starts, peak_stops in iter_peaks_by_chromosome(cur, index, **filters):
+            peak_rows, rows, distances, ranks = index.nearest(chromosome, peak_starts, peak_stops, k, tss=mode == "tss")
+
+            for offset in range(0, len(rows), chunk_size):
+                peak_part = peak_rows[offset:offset + chunk_size]
+                part = rows[offset:offset + chunk_size]
+                if mode == "tss":
+                    gene_part = index.tss_genes[part]
+                    tss = index.tss[part]
+                    strands = index.tss_strands[part]
+                    # the gap is signed: peak before the TSS on the strand = upstream = negative
+                    upstream = np.where(strands == "-", peak_starts[peak_part] > tss, peak_stops[peak_part] < tss)
+                    gaps = np.where(upstream, -distances[offset:offset + chunk_size], distances[offset:offset + chunk_size])
+                    gene_columns = zip(
+                        strands.tolist(),
+                        index.transcript_names[index.transcript_codes[part]].tolist(),
+                        tss.tolist()
+                    )
+                else:
+                    gene_part = part
+                    gaps = distances[offset:offset + chunk_size]
+                    gene_columns = zip(
+                        index.strands[part].tolist(),
+                        index.starts[part].tolist(),
+                        index.stops[part].tolist()
+                    )
+                yield [
+                    bed[:2] + (chromosome,) + bed[2:] + (rank, gene_id, gene_name) + columns + (gap,)
+                    for bed, rank, gene_id, gene_name, columns, gap in zip(
+                        (peaks[position] for position in peak_part.tolist()),
+                        ranks[offset:offset + chunk_size].tolist(),
+                        index.ids[gene_part].tolist(),
+                        index.names[index.name_codes[gene_part]].tolist(),
+                        gene_columns,
+                        gaps.tolist()
+                    )
+                ]
+        cur.close()
+    finally:
+        conn.close()
+
+
+def iter_genes_near_peaks_sql(distance, chunk_size=FETCH_CHUNK_SIZE, **filters):
+    """iter_genes_near_peaks in SQLite only, one GENES_NEAR_PEAKS_QUERY per chromosome."""
+    return iter_annotation_query(GENES_NEAR_PEAKS_QUERY, distance, chunk_size, **filters)
+
+
+# Genes per parallel annotation task; chromosomes with more genes are split into ranges of gene starts
+PARALLEL_GENES_PER_TASK = 2000
+
+# Below this many peaks (of the selected experiments) the process pool costs more than it saves
+PARALLEL_MIN_PEAKS = 1000000
+
+# Lower bound of the keyset of a parallel task that has not returned rows yet
+KEYSET_MIN = -2 ** 63
+
+
+def plan_annotation_tasks(conn, chromosome=None, genes_per_task=PARALLEL_GENES_PER_TASK):
+    """Splits the genes into (chromosome_id, widest peak, start_from, start_to) tasks.
+
+    start_from (inclusive) and start_to (exclusive) bound g.start, None is open ended.
+    The tasks are in the chromosome order of annotation_chromosomes and by gene start,
+    so concatenating their results gives the result of iter_genes_near_peaks_sql.
+    """
+    cur = conn.cursor()
+    tasks = []
+    for chrom, max_width in annotation_chromosomes(cur, chromosome):
+        cur.execute("SELECT count(*) FROM genes WHERE chromosome_id = ?", (chrom,))
+        gene_count = cur.fetchone()[0]
+        bounds = [None]
+        for offset in range(genes_per_task, gene_count, genes_per_task):
+            cur.execute("SELECT start FROM genes WHERE chromosome_id = ? ORDER BY start LIMIT 1 OFFSET ?", (chrom, offset))
+            start = cur.fetchone()[0]
+            if start != bounds[-1]:  # genes sharing a start stay in one task
+                bounds.append(start)
+        bounds.append(None)
+        tasks.extend((chrom, max_width, start_from, start_to) for start_from, start_to in zip(bounds, bounds[1:]))
+    cur.close()
+    return tasks
+
+
+def annotation_task_clause(start_from, start_to):
+    """SQL conditions restricting the nearby-gene query of a chromosome to the genes of one task.
+
+    Every gene only reads the peaks of its own window, so the peaks need no extra bounds.
+    The last five parameters are the keyset of the ORDER BY that resume_annotation_task
+    moves past the rows already returned.
+    """
+    clauses = []
+    params = []
+    if start_to is not None:
+        clauses.append("g.start < ?")
+        params.append(start_to)
+    clauses += ["g.start >= ?", "(g.start, g.id, b.start, b.id) > (?, ?, ?, ?)"]
+    start_from = KEYSET_MIN if start_from is None else start_from
+    params += [start_from, start_from, KEYSET_MIN, KEYSET_MIN, KEYSET_MIN]
+    return "".join(f"\n      AND {clause}" for clause in clauses), params
+
+
+def resume_annotation_task(sql, params, last_row):
+    """The task of the rows after last_row, for a worker result cut off at its row limit."""
+    gene_id, gene_start, bed_id, bed_start = last_row[0], last_row[3], last_row[5], last_row[8]
+    return sql, params[:-5] + [gene_start, gene_start, gene_id, bed_start, bed_id]
+
+
+def selected_peak_count(cur, experiment_ids=None):
+    """Number of peaks of the experiment_ids (default: all), from experiment_peak_counts."""
+    query = "SELECT COALESCE(sum(peak_count), 0) FROM experiment_peak_counts"
+    if experiment_ids:
+        query += f" WHERE experiment_id IN ({', '.join('?' * len(experiment_ids))})"
+    cur.execute(query, experiment_ids or ())
+    return cur.fetchone()[0]
+
+
+def iter_genes_near_peaks_parallel(distance, workers=None, chunk_size=FETCH_CHUNK_SIZE, **filters):
+    """Parallel variant of iter_genes_near_peaks with the same rows in the same order.
+
+    The genes are split by chromosome (and by gene start ranges on gene rich chromosomes),
+    and up to workers parts (default: all cores) run at a time in the process pool shared
+    by all requests, against read-only connections. A worker returns at most
+    parallel_annotation.ROWS_PER_RESULT rows at a time. With a single core or fewer than
+    PARALLEL_MIN_PEAKS peaks selected the serial iter_genes_near_peaks is used instead.
+    """
+    workers = workers or os.cpu_count() or 1
+    peak_filter, filter_params = peak_filter_clause(**filters)
+    conn = db_pool.acquire()
+    try:
+        ensure_compact_schema(conn)
+        ensure_summary_counts(conn)
+        serial = workers < 2 or selected_peak_count(conn.cursor(), filters.get("experiment_ids")) < PARALLEL_MIN_PEAKS
+        plan = None if serial else plan_annotation_tasks(conn, filters.get("chromosome"))
+    finally:
+        conn.close()
+    if serial:
+        yield from iter_genes_near_peaks(distance, chunk_size, **filters)
+        return
+
+    tasks = []
+    for chromosome_id, max_width, start_from, start_to in plan:
+        task_filter, task_params = annotation_task_clause(start_from, start_to)
+        tasks.append((
+            GENES_NEAR_PEAKS_QUERY.format(peak_filter=peak_filter + task_filter),
+            [distance + max_width, distance, chromosome_id, distance] + filter_params + task_params
+        ))
+
+    for rows in iter_ordered_query_results(db_pool.db_path(), tasks, resume_annotation_task, workers):
+        for offset in range(0, len(rows), chunk_size):
+            yield rows[offset:offset + chunk_size]
+
+
+def get_genes_near_peaks(distance, **filters):
+    try:
+        results = []
+        for rows in iter_genes_near_peaks(distance, **filters):
+            results.extend(rows)
+        return results
+    except Exception as e:
+        print(f"Error executing query: {e}")
         return None
 
 
+def stream_tsv(header, chunks):
+    """Turns an iterator over row lists into UTF-8 encoded TSV chunks.
+
+    Only one chunk of rows is held in memory at any time.
+    """
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter="\t")
+
+    try:
+        writer.writerow(header)
+        for rows in chunks:
+            writer.writerows(rows)
+            data = output.getvalue().encode("utf-8")
+            output.seek(0)
+            output.truncate(0)
+            if data:
+                yield data
+    finally:
+        # make sure the cursor is released if the client goes away mid download
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
+
+
+def get_data_version():
+    """Returns '<database id>.<data version>', the version of the data cached results are computed from.
+
+    The data version is the counter the loaders advance on every BED/GTF load. It starts
+    at 0 again in a new genome.db, so a random id of the database is added; results
+    cached for an earlier genome.db in the same folder are never served for the new one.
+    """
+    conn = create_connection()
+    ensure_summary_counts(conn)
+    cur = conn.cursor()
+    # databases from before the id existed get one here
+    cur.execute("INSERT OR IGNORE INTO summary_counts (name, count) VALUES ('database_id', ?)",
+                (uuid.uuid4().int >> 66,))
+    if cur.rowcount:
+        conn.commit()
+    cur.execute("SELECT name, count FROM summary_counts WHERE name IN ('database_id', 'data_version')")
+    counts = dict(cur.fetchall())
+    cur.close()
+    conn.close()
+    return f"{counts['database_id']:x}.{counts.get('data_version', 0)}"
+
+
+_result_cache = None
+
+def get_result_cache():
+    # Kept next to genome.db, so cached downloads survive server restarts
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = ResultCache(os.path.join(os.path.dirname(db_pool.db_path()), "result_cache"))
+    return _result_cache
+
+
+def iter_file_chunks(file, chunk_size=65536):
+    with file:
+        while True:
+            data = file.read(chunk_size)
+            if not data:
+                break
+            yield data
+
+
+def iter_gunzipped_chunks(file, chunk_size=65536):
+    with file, gzip.GzipFile(fileobj=file, mode="rb") as uncompressed:
+        yield from iter_file_chunks(uncompressed, chunk_size)
+
+
+def peak_filters_from_form(form):
+    """Reads the optional peak filters (experiments, chromosome/region, minimum score) of a form.
+
+    Returns the keyword arguments for peak_filter_clause; raises ValueError with a message
+    for the user on an invalid region.
+    """
+    filters = {
+        "experiment_ids": sorted(form.getlist("experiment_ids", type=int)),
+        "min_score": form.get("min_score", type=float),
+    }
+    region = form.get("region", "").strip()
+    if region:
+        try:
+            filters["chromosome"], filters["start"], filters["stop"] = parse_region(region)
+        except ValueError:
+            raise ValueError(f"Please provide a region like 'chr6' or 'chr6:70000000-71000000' - not '{region}'")
+    return filters
+
+
+# Download formats of the result endpoints; arrow and parquet need pyarrow
+DOWNLOAD_FORMATS = ("tsv", "tsv.gz", "arrow", "parquet")
+
+
+def download_format_from_form(form):
+    """The requested download format; the compress checkbox turns tsv into tsv.gz."""
+    output = form.get("format", "tsv")
+    if output == "tsv" and form.get("compress") in ("1", "on", "true", "gzip"):
+        output = "tsv.gz"
+    if output not in DOWNLOAD_FORMATS:
+        raise ValueError(f"Please select one of the formats {', '.join(DOWNLOAD_FORMATS)} - not '{output}'")
+    if output in COLUMNAR_FORMATS and not ARROW_AVAILABLE:
+        raise ValueError(f"The {output} format needs pyarrow installed on the server")
+    return output
+
+
+def result_download(name, header, column_types, chunks, output, empty_message, **cache_params):
+    """Response streaming the rows of chunks as a download in format output.
+
+    TSV is sent as text or gzip compressed; arrow and parquet are encoded batch by batch
+    with column_types. chunks is a function returning the generator of row lists; it is
+    only called when the result is not in the result cache under cache_params. The first
+    chunk is fetched up front, so query errors and empty results (empty_message) are
+    still reported.
+    """
+    if output in COLUMNAR_FORMATS:
+        mimetype, suffix = COLUMNAR_FORMATS[output]
+    else:
+        mimetype, suffix = ("application/gzip", ".csv.gz") if output == "tsv.gz" else ("text/csv", ".csv")
+    headers = {"Content-Disposition": f"attachment;filename={name}{suffix}"}
+    # TSV is cached gzip compressed, the columnar formats as they are sent
+    stored_as_sent = output != "tsv"
+
+    # Repeated requests are answered from the result of an earlier identical one
+    cache = get_result_cache()
+    version = get_data_version()
+    cache_key = cache.key(version, "tsv" if output == "tsv.gz" else output, name=name, **cache_params)
+    cached = cache.open(cache_key, version)
+    if cached is not None:
+        body = iter_file_chunks(cached) if stored_as_sent else iter_gunzipped_chunks(cached)
+        headers["X-Result-Cache"] = "hit"
+        metrics.RESULT_CACHE_REQUESTS.inc(download=name, result="hit")
+        return Response(body, mimetype=mimetype, headers=headers)
+
+    # Rows are pulled from the cursor chunk by chunk while the response is sent
+    rows = chunks()
+    first = next(rows, None)
+    if first is None:
+        return empty_message
+
+    metrics.RESULT_CACHE_REQUESTS.inc(download=name, result="miss")
+    rows = metrics.iter_download_rows(first, rows, download=name, format=output)
+    if output in COLUMNAR_FORMATS:
+        body = iter_columnar(output, header, column_types, rows)
+    else:
+        body = stream_tsv(header, rows)
+        if output == "tsv.gz":
+            body = gzip_chunks(body)
+    # the result is written to the cache while it is sent
+    body = cache.store(cache_key, body, compressed=stored_as_sent)
+    headers["X-Result-Cache"] = "miss"
+    return Response(body, mimetype=mimetype, headers=headers)
+
+
 # Route to handle the download of the CSV file
 @app.route("/get_genes", methods=["POST"])
 def get_genes():
     try:
         # Get the distance parameter from the query string
         distance = request.form.get("distance", type=int)
+        parallel = request.form.get("parallel") in ("1", "on", "true")
+        # 'gene': peaks within distance of the gene body, 'tss': of a transcription start site
+        mode = request.form.get("mode", "gene")
+        if mode not in ("gene", "tss"):
+            return f"Please select the gene or the tss mode - not '{mode}'"
 
         if not distance:
             return f"Please provide a valid distance parameter - not '{distance}'"
 
-        # Call the function to get genes near peaks
-        results = get_genes_near_peaks(distance)
-
-        if results:
-            # Prepare the CSV output
-            output = io.StringIO()
-            writer = csv.writer(output, delimiter="\t" )
-            #    gene_id INT,    gene_name TEXT,    chromosome TEXT,    gene_start INT,    gene_stop INT,    bed_id INT,    experiment_id INT,    bed_chromosome TEXT,    bed_start INT,    bed_stop INT,    peak_score FLOAT,    feature_name TEXT,    distance INT            writer.writerow(["Gene ID", "Gene Name", "Peak ID", "Distance (bp)"])  
-            # Header row based on the table structure
-            writer.writerow([
-                "Gene ID", "Gene Name", "Chromosome", "Gene Start", "Gene Stop", "BED ID", 
-                "Experiment ID", "BED Chromosome", "BED Start", "BED Stop", "Peak Score", 
-                "Feature Name", "Distance (bp)"
-            ])  # header row
-            # Write the data rows
-            writer.writerows(results)
+        # Optional peak filters: experiments, chromosome/region and a minimum peak score
+        try:
+            filters = peak_filters_from_form(request.form)
+            output = download_format_from_form(request.form)
+        except ValueError as e:
+            return str(e)
+
+        if mode == "tss":
+            chunks = lambda: iter_tss_near_peaks(distance, **filters)
+        elif parallel:
+            chunks = lambda: iter_genes_near_peaks_parallel(distance, **filters)
+        else:
+            chunks = lambda: iter_genes_near_peaks(distance, **filters)
+        return result_download(
+            "tss_near_peaks" if mode == "tss" else "genes_near_peaks",
+            TSS_NEAR_PEAKS_HEADER if mode == "tss" else GENES_NEAR_PEAKS_HEADER,
+            TSS_NEAR_PEAKS_TYPES if mode == "tss" else GENES_NEAR_PEAKS_TYPES,
+            chunks, output, "No results found for the given distance.",
+            distance=distance, **filters
+        )
 
-            output.seek(0)
+    except Exception as e:
+        return f"An error occurred: {e}"
 
-            # Create a response to trigger a download
-            return Response(
-                output,
-                mimetype="text/csv",
-                headers={"Content-Disposition": "attachment;filename=genes_near_peaks.csv"},
-            )
-        else:
-            return "No results found for the given distance."
+
+@app.route("/nearest_genes", methods=["POST"])
+def nearest_genes():
+    try:
+        k = request.form.get("k", 1, type=int)
+        mode = request.form.get("mode", "gene")
+        if mode not in ("gene", "tss"):
+            return f"Please select the gene or the tss mode - not '{mode}'"
+        if not k or not 1 <= k <= MAX_NEAREST_GENES:
+            return f"Please provide a number of genes between 1 and {MAX_NEAREST_GENES} - not '{k}'"
+        if np is None:
+            return "The nearest gene search needs NumPy installed on the server"
+
+        try:
+            filters = peak_filters_from_form(request.form)
+            output = download_format_from_form(request.form)
+        except ValueError as e:
+            return str(e)
+
+        return result_download(
+            "nearest_tss" if mode == "tss" else "nearest_genes",
+            NEAREST_TSS_HEADER if mode == "tss" else NEAREST_GENES_HEADER,
+            NEAREST_TSS_TYPES if mode == "tss" else NEAREST_GENES_TYPES,
+            lambda: iter_nearest_genes(k, mode, **filters), output, "No peaks found for the given filters.",
+            k=k, **filters
+        )
 
     except Exception as e:
         return f"An error occurred: {e}"
@@ -375,19 +1578,451 @@ def upload_gtf():
         if not gtf_file:
             return f"Please provide a valid file - not '{gtf_file}'"
 
-        #raise RuntimeError( f"What have I gotten here: '{gtf_file.filename}'??")
-        # Call the function to get genes near peaks
-        load_gtf_to_postgres(gtf_file)
+        # The file is spooled and loaded in the background; the job shows up on the landing page
+        filename = secure_filename(gtf_file.filename)
+        path, _ = spool_upload(gtf_file)
+        job = ingest_jobs.submit("gtf", filename, path, ingest_gtf_job, filename)
 
-        return redirect(url_for('index'))
+        return job_response(job)
     except Exception as e:
         return f"An error occurred: {e}"
 
 
+def spool_upload(file):
+    """Copies an upload to $PGDATA/spool so a background job can read it after the request.
+
+    Returns the path and the SHA-256 of the upload, computed while it is copied.
+    """
+    spool_dir = os.path.join(os.path.dirname(db_pool.db_path()), "spool")
+    os.makedirs(spool_dir, exist_ok=True)
+    path = os.path.join(spool_dir, f"{uuid.uuid4().hex}_{secure_filename(file.filename)}")
+    with open(path, 'wb') as target:
+        content_hash = copy_and_hash(file.stream, target)
+    return path, content_hash
+
+
+@contextlib.contextmanager
+def timed_ingest(kind):
+    started = time.perf_counter()
+    status = "failed"
+    try:
+        yield
+        status = "done"
+    except JobSkipped:
+        status = "skipped"
+        raise
+    finally:
+        metrics.INGEST_JOB_SECONDS.observe(time.perf_counter() - started, kind=kind, status=status)
+
+
+def ingest_bed_job(path, progress, experiment_id, filename, content_hash=None, replace=False):
+    with timed_ingest("bed"):
+        with open(path, 'rb') as raw:
+            rows = load_bed_file(FileStorage(stream=ProgressReader(raw, progress), filename=filename),
+                                 experiment_id, content_hash, replace)
+        if rows is None:
+            raise JobSkipped(f"identical file already loaded into experiment {experiment_id}")
+        # the overview shows the co-occupancy of the new peaks without another request
+        update_cooccupancy()
+    return rows
+
+
+def ingest_gtf_job(path, progress, filename):
+    with timed_ingest("gtf"):
+        with open(path, 'rb') as raw:
+            message = load_gtf_to_postgres(FileStorage(stream=ProgressReader(raw, progress), filename=filename))
+        if message.startswith("Error"):
+            raise ValueError(message)
+
+
+def job_response(job):
+    # Scripts asking for JSON get the job to poll at /jobs/<id>, browsers go back to the overview
+    if request.accept_mimetypes.best_match(["text/html", "application/json"]) == "application/json":
+        return jsonify(job.to_dict()), 202
+    return redirect(url_for('index'))
+
+
+def ensure_cooccupancy_tables(conn):
+    """Creates the cached co-occupancy matrix.
+
+    experiment_coverage holds the bases covered by the peaks of every experiment and the
+    peak count the values were computed for; cooccupancy holds, per ordered pair, the
+    peaks of experiment_a overlapping a peak of experiment_b and the bases both cover.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'cooccupancy'")
+    if cur.fetchone() is None:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS experiment_coverage (
+                experiment_id INTEGER PRIMARY KEY,
+                peak_count INT NOT NULL,
+                covered_bp INT NOT NULL
+            )""")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS cooccupancy (
+                experiment_a INT NOT NULL,
+                experiment_b INT NOT NULL,
+                overlapping_peaks INT NOT NULL,
+                shared_bp INT NOT NULL,
+                PRIMARY KEY (experiment_a, experiment_b)
+            ) WITHOUT ROWID""")
+        conn.commit()
+    cur.close()
+
+
+# Only one co-occupancy update runs at a time; a second caller waits and finds nothing to do
+_cooccupancy_lock = threading.Lock()
+
+
+# A peak overlapping a window [start, stop) starts in [start - widest peak, stop) and ends
+# after start. The windows are stored in rowid order, so the peaks come out sorted by start.
+STALE_WINDOW_PEAKS_QUERY = """
+    SELECT b.experiment_id, b.start, b.stop
+    FROM temp.cooccupancy_windows w
+    CROSS JOIN bed b ON b.chromosome_id = ? AND b.start >= w.start - ? AND b.start < w.stop
+    WHERE b.stop > w.start
+    ORDER BY w.rowid, b.start
+"""
+
+
+def stale_peak_windows(cur, chromosome_id, stale, max_width):
+    """Stores the windows of the peaks of the stale experiments on a chromosome in
+    temp.cooccupancy_windows for STALE_WINDOW_PEAKS_QUERY.
+
+    The peaks are merged into windows far enough apart that the ranges of bed starts
+    STALE_WINDOW_PEAKS_QUERY reads for them (widened by max_width, the widest peak of the
+    chromosome in bed_widths) do not overlap, so no peak is read twice. idx_bed_experiment
+    holds the primary key, so the peaks of each stale experiment are one index range.
+    Returns the number of windows.
+    """
+    cur.execute(f"""SELECT start, stop FROM bed
+        WHERE experiment_id IN ({', '.join('?' * len(stale))}) AND chromosome_id = ?""",
+                [*stale, chromosome_id])
+    windows = []
+    for start, stop in sorted(cur.fetchall()):
+        if windows and start - max_width <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], stop)
+        else:
+            windows.append([start, stop])
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS cooccupancy_windows (start INT NOT NULL, stop INT NOT NULL)")
+    cur.execute("DELETE FROM temp.cooccupancy_windows")
+    cur.executemany("INSERT INTO temp.cooccupancy_windows (start, stop) VALUES (?, ?)", windows)
+    return len(windows)
+
+
+def update_cooccupancy():
+    """Computes the co-occupancy of the experiments added or changed since the last update.
+
+    An experiment is recomputed when its current peak count differs from the one its
+    values were computed for. Per chromosome only the peaks near the peaks of such an
+    experiment are read (stale_peak_windows, unless the stale experiments hold most of the
+    peaks) and swept, counting only the pairs involving
+    it; the stored values of all other pairs are kept. The peaks are read in one read
+    transaction and the results written afterwards, so uploads are not blocked meanwhile.
+    Returns the number of experiments recomputed.
+    """
+    conn = db_pool.acquire()
+    try:
+        ensure_compact_schema(conn)
+        ensure_summary_counts(conn)
+        ensure_bed_widths(conn)
+        ensure_cooccupancy_tables(conn)
+        with _cooccupancy_lock:
+            cur = conn.cursor()
+            cur.execute("BEGIN")  # one consistent snapshot for all chromosomes
+            cur.execute("""
+                SELECT p.experiment_id, p.peak_count, c.peak_count
+                FROM experiment_peak_counts p
+                LEFT JOIN experiment_coverage c ON c.experiment_id = p.experiment_id
+                WHERE p.peak_count > 0
+                ORDER BY p.experiment_id
+            """)
+            counts = cur.fetchall()
+            positions = {experiment_id: position for position, (experiment_id, _, _) in enumerate(counts)}
+            stale = [experiment_id for experiment_id, peak_count, computed in counts if peak_count != computed]
+            stale_mask = sum(1 << positions[experiment_id] for experiment_id in stale)
+            # when the stale experiments hold most peaks (first upload, rebuild) the windows
+            # cover about every peak anyway and reading whole chromosomes is cheaper
+            stale_peaks = sum(peak_count for _, peak_count, computed in counts if peak_count != computed)
+            whole_chromosomes = stale_peaks * 2 >= sum(peak_count for _, peak_count, _ in counts)
+
+            overlaps = collections.Counter()
+            covered = collections.Counter()
+            shared = collections.Counter()
+            if stale:
+                cur.execute("SELECT chromosome_id, max_width FROM bed_widths")
+                for chromosome_id, max_width in cur.fetchall():
+                    if whole_chromosomes:
+                        cur.execute("SELECT experiment_id, start, stop FROM bed WHERE chromosome_id = ? ORDER BY start",
+                                    (chromosome_id,))
+                    elif stale_peak_windows(cur, chromosome_id, stale, max_width):
+                        cur.execute(STALE_WINDOW_PEAKS_QUERY, (chromosome_id, max_width))
+                    else:
+                        continue
+                    peaks = [(positions[row[0]], row[1], row[2]) for row in cur if row[0] in positions]
+                    overlaps.update(overlapping_peaks(peaks, stale_mask))
+                    chromosome_covered, chromosome_shared = covered_bases(peaks, stale_mask)
+                    covered.update(chromosome_covered)
+                    shared.update(chromosome_shared)
+            conn.commit()
+
+            ids = [experiment_id for experiment_id, _, _ in counts]
+            peak_counts = {experiment_id: peak_count for experiment_id, peak_count, _ in counts}
+            with write_lock:
+                # experiments without peaks (or removed) drop out of the matrix
+                cur.execute("""
+                    DELETE FROM experiment_coverage WHERE experiment_id NOT IN (
+                        SELECT experiment_id FROM experiment_peak_counts WHERE peak_count > 0)
+                """)
+                cur.execute("""
+                    DELETE FROM cooccupancy WHERE experiment_a NOT IN (SELECT experiment_id FROM experiment_coverage)
+                        OR experiment_b NOT IN (SELECT experiment_id FROM experiment_coverage)
+                """)
+                pairs = []
+                for a in stale:
+                    for b in ids:
+                        if a == b:
+                            continue
+                        pa, pb = positions[a], positions[b]
+                        both = shared[min(pa, pb), max(pa, pb)]
+                        pairs.append((a, b, overlaps[pa, pb], both))
+                        pairs.append((b, a, overlaps[pb, pa], both))
+                cur.executemany("INSERT OR REPLACE INTO cooccupancy VALUES (?, ?, ?, ?)", pairs)
+                cur.executemany(
+                    "INSERT OR REPLACE INTO experiment_coverage (experiment_id, peak_count, covered_bp) VALUES (?, ?, ?)",
+                    [(a, peak_counts[a], covered[positions[a]]) for a in stale])
+                conn.commit()
+            cur.close()
+            return len(stale)
+    finally:
+        conn.close()
+
+
+def read_cooccupancy(conn):
+    """The cached co-occupancy matrix of the experiments computed so far.
+
+    Returns {"experiments": [{id, name, peaks, covered_bp}], "overlapping_peaks": rows,
+    "jaccard": rows} with rows[i][j] for experiments i and j: the peaks of i overlapping a
+    peak of j, and the bases covered by both / the bases covered by either. Pairs that
+    are not computed yet are None.
+    """
+    ensure_cooccupancy_tables(conn)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT e.id, e.experiment_name, c.peak_count, c.covered_bp
+        FROM experiment_coverage c JOIN experiments e ON e.id = c.experiment_id
+        ORDER BY e.id
+    """)
+    experiments = [{"id": row[0], "name": row[1], "peaks": row[2], "covered_bp": row[3]} for row in cur.fetchall()]
+    positions = {experiment["id"]: position for position, experiment in enumerate(experiments)}
+    overlaps = [[None] * len(experiments) for _ in experiments]
+    jaccard = [[None] * len(experiments) for _ in experiments]
+    for position, experiment in enumerate(experiments):
+        overlaps[position][position] = experiment["peaks"]
+        jaccard[position][position] = 1.0
+    cur.execute("SELECT experiment_a, experiment_b, overlapping_peaks, shared_bp FROM cooccupancy")
+    for a, b, overlapping, shared in cur.fetchall():
+        if a in positions and b in positions:
+            pa, pb = positions[a], positions[b]
+            union = experiments[pa]["covered_bp"] + experiments[pb]["covered_bp"] - shared
+            overlaps[pa][pb] = overlapping
+            jaccard[pa][pb] = shared / union if union else 0.0
+    cur.close()
+    return {"experiments": experiments, "overlapping_peaks": overlaps, "jaccard": jaccard}
+
+
+@app.route("/cooccupancy")
+def cooccupancy():
+    """Pairwise overlap counts and Jaccard indices of all experiments as JSON.
+
+    Only reads the stored matrix; the upload jobs, deletes and the server start update it.
+    """
+    conn = create_connection()
+    return jsonify(read_cooccupancy(conn))
+
+
+@app.route("/density/<int:experiment_id>")
+def peak_density(experiment_id):
+    """Binned peak density track of one experiment.
+
+    ?bin_size= one of DENSITY_BIN_SIZES (default 100000), ?value=peaks|score for the
+    bedGraph and ?format=bedgraph|binary (see density_tracks.pack_density).
+    """
+    bin_size = request.args.get("bin_size", 100000, type=int)
+    value = request.args.get("value", "peaks")
+    output = request.args.get("format", "bedgraph")
+    if bin_size not in DENSITY_BIN_SIZES:
+        return jsonify({"error": f"bin_size has to be one of {', '.join(map(str, DENSITY_BIN_SIZES))}"}), 400
+    if value not in DENSITY_VALUES or output not in ("bedgraph", "binary"):
+        return jsonify({"error": "value has to be peaks or score and format bedgraph or binary"}), 400
+
+    conn = create_connection()
+    ensure_compact_schema(conn)
+    ensure_peak_density(conn)
+    cur = conn.cursor()
+    cur.execute("SELECT experiment_name FROM experiments WHERE id = ?", (experiment_id,))
+    experiment = cur.fetchone()
+    if experiment is None:
+        return jsonify({"error": f"No experiment {experiment_id}"}), 404
+    # one range of the primary key, sorted by chromosome name afterwards
+    cur.execute("""
+        SELECT c.name, d.bin, d.peaks, d.score_sum FROM peak_density d
+        JOIN chromosomes c ON c.id = d.chromosome_id
+        WHERE d.experiment_id = ? AND d.bin_size = ?
+        ORDER BY c.name, d.bin
+    """, (experiment_id, bin_size))
+    rows = cur.fetchall()
+    cur.close()
+
+    filename = f"{secure_filename(experiment[0]) or experiment_id}_{bin_size}"
+    if output == "binary":
+        return Response(pack_density(rows, bin_size), mimetype="application/octet-stream",
+                        headers={"Content-Disposition": f"attachment;filename={filename}.pkdn"})
+    return Response(iter_bedgraph(rows, bin_size, value, experiment[0]), mimetype="text/plain",
+                    headers={"Content-Disposition": f"attachment;filename={filename}_{value}.bedGraph"})
+
+
+# Page size of the region API: default and upper limit
+REGION_PAGE_SIZE = 1000
+MAX_REGION_PAGE_SIZE = 10000
+
+# Keyset pagination: a page continues after the (start, id) of the last row of the
+# previous one, so every page is one range of the (chromosome_id, start, id) key of bed,
+# however deep it is
+REGION_PEAKS_QUERY = """
+    SELECT b.id, b.experiment_id, e.experiment_name, c.name, b.start, b.stop, b.peak_score, b.feature_name
+    FROM bed b
+    JOIN chromosomes c ON c.id = b.chromosome_id
+    JOIN experiments e ON b.experiment_id = e.id
+    WHERE b.chromosome_id = ? AND b.start >= ? AND b.start <= ? AND b.stop >= ?
+      AND (b.start, b.id) > (?, ?){peak_filter}
+    ORDER BY b.start, b.id
+    LIMIT ?;
+"""
+
+# The cursor start also bounds the R*Tree probe (r.start is the gene start), so a deeper
+# page does not read the genes of all earlier pages again.
+# Parameters: region stop, region start, cursor start, chromosome, cursor start and id, limit.
+REGION_GENES_QUERY = """
+    SELECT g.id, g.gene_name, c.name, g.start, g.stop, g.strand
+    FROM chromosomes c
+    CROSS JOIN genes_rtree r
+        ON r.chrom_min <= c.id AND r.chrom_max >= c.id AND r.start <= ? AND r.stop >= ?
+        AND r.start >= ?
+    JOIN genes g ON g.id = r.id
+    WHERE c.name = ? AND (g.start, g.id) > (?, ?)
+    ORDER BY g.start, g.id
+    LIMIT ?;
+"""
+
+REGION_PEAK_FIELDS = ("id", "experiment_id", "experiment_name", "chromosome", "start", "stop", "peak_score", "feature_name")
+REGION_GENE_FIELDS = ("id", "gene_name", "chromosome", "start", "stop", "strand")
+
+
+def region_page_args(args):
+    """Reads region, limit and cursor of a region API request.
+
+    Returns (chromosome, start, stop, limit, after) with after the (start, id) the page
+    continues after; raises ValueError with a message for the client.
+    """
+    region = args.get("region", "").strip()
+    if not region:
+        raise ValueError("Please provide a region like 'chr6' or 'chr6:70000000-71000000'")
+    try:
+        chromosome, start, stop = parse_region(region)
+    except ValueError:
+        raise ValueError(f"Please provide a region like 'chr6' or 'chr6:70000000-71000000' - not '{region}'")
+    limit = args.get("limit", REGION_PAGE_SIZE, type=int)
+    if not limit or not 1 <= limit <= MAX_REGION_PAGE_SIZE:
+        raise ValueError(f"limit has to be between 1 and {MAX_REGION_PAGE_SIZE}")
+    cursor = args.get("cursor")
+    try:
+        after = tuple(int(value) for value in cursor.split("_")) if cursor else (-1, -1)
+        if len(after) != 2:
+            raise ValueError
+    except ValueError:
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    # a bare chromosome covers all of it
+    return chromosome, 0 if start is None else start, 2 ** 62 if stop is None else stop, limit, after
+
+
+def region_page(rows, fields, limit, **meta):
+    """The JSON body of one page; next is the cursor of the following page or None."""
+    items = [dict(zip(fields, row)) for row in rows]
+    meta["items"] = items
+    meta["next"] = f"{items[-1]['start']}_{items[-1]['id']}" if len(items) == limit else None
+    return jsonify(meta)
+
+
+@app.route("/api/peaks")
+def region_peaks():
+    """Peaks overlapping ?region=, optionally restricted by experiment_ids and min_score."""
+    try:
+        chromosome, start, stop, limit, after = region_page_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    peak_filter, filter_params = peak_filter_clause(
+        experiment_ids=request.args.getlist("experiment_ids", type=int),
+        min_score=request.args.get("min_score", type=float)
+    )
+
+    conn = create_connection()
+    ensure_compact_schema(conn)
+    ensure_bed_widths(conn)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT w.chromosome_id, w.max_width FROM bed_widths w
+        JOIN chromosomes c ON c.id = w.chromosome_id WHERE c.name = ?
+    """, (chromosome,))
+    width = cur.fetchone()
+    rows = []
+    if width is not None:
+        cur.execute(
+            REGION_PEAKS_QUERY.format(peak_filter=peak_filter),
+            [width[0], start - width[1], stop, start, after[0], after[1]] + filter_params + [limit]
+        )
+        rows = cur.fetchall()
+    cur.close()
+    return region_page(rows, REGION_PEAK_FIELDS, limit, region=request.args["region"])
+
+
+@app.route("/api/genes")
+def region_genes():
+    """Genes overlapping ?region=, from the genes R*Tree."""
+    try:
+        chromosome, start, stop, limit, after = region_page_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    conn = create_connection()
+    ensure_compact_schema(conn)
+    ensure_gene_interval_index(conn)
+    cur = conn.cursor()
+    cur.execute(REGION_GENES_QUERY, (stop, start, after[0], chromosome, after[0], after[1], limit))
+    rows = cur.fetchall()
+    cur.close()
+    return region_page(rows, REGION_GENE_FIELDS, limit, region=request.args["region"])
+
+
+@app.route("/jobs")
+def list_jobs():
+    return jsonify([job.to_dict() for job in ingest_jobs.jobs()])
+
+
+@app.route("/jobs/<int:job_id>")
+def job_status(job_id):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"No job {job_id}"}), 404
+    return jsonify(job.to_dict())
+
+
 def load_gtf_to_postgres(gtf_file):
-    """Loads a GTF file into a PostgreSQL database using a temporary SQL dump for efficiency."""
+    """Loads an uploaded GTF file into the database, parsing and inserting it in streamed batches."""
 
     conn = create_connection()
+    ensure_summary_counts(conn)
+    ensure_compact_schema(conn)
     cur = conn.cursor()
 
     # Check if GTF has already been uploaded
@@ -400,84 +2035,60 @@ def load_gtf_to_postgres(gtf_file):
     cur.execute(f"INSERT INTO info (info) VALUES ('gene info from {gtf_file.filename}');")
     conn.commit()
 
-    pgdata_path = os.getenv("PGDATA")
-    if pgdata_path:
-        print(f"PGDATA is set to: {pgdata_path}")
-    else:
-        print("PGDATA is not set.")
-
-    temp_sql_path = os.path.join(pgdata_path, "temp_import.sql")
-    gene_id_counter = 1  # Start counting genes from 1
-
+    # Gene ids are assigned by the parser, so transcripts are linked to their gene through
+    # the gene_id attribute; continue after any genes already in the table
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM genes;")
+    first_gene_id = cur.fetchone()[0] + 1
+
+    # The upload is parsed as a stream (decompressing gzip/bgzip on the fly) and written in fixed-size batches
+    with write_lock:
+        batches = metrics.iter_timed_parse(
+            "gtf", iter_gtf_batches(open_input(gtf_file.stream), first_gene_id),
+            lambda batch: len(batch[0]) + len(batch[1]))
+        for gene_entries, transcript_entries in batches:
+            # the parser gives chromosome names (third column of both); rows store their id
+            ids = chromosome_ids(cur, {row[2] for row in gene_entries} | {row[2] for row in transcript_entries})
+            if gene_entries:
+                cur.executemany(
+                    "INSERT INTO genes (id, gene_name, chromosome_id, start, stop, strand) VALUES (?, ?, ?, ?, ?, ?)",
+                    [row[:2] + (ids[row[2]],) + tuple(row[3:]) for row in gene_entries])
+                add_summary_count(cur, "genes", len(gene_entries))
+
+            if transcript_entries:
+                cur.executemany(
+                    """INSERT INTO transcripts (gene_id, transcript_name, chromosome_id, start, stop, strand, tss)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                    [row[:2] + (ids[row[2]],) + tuple(row[3:]) for row in transcript_entries])
+                add_summary_count(cur, "transcripts", len(transcript_entries))
+
+        cur.execute ( "CREATE INDEX IF NOT EXISTS idx_genes_chromosome_start ON genes(chromosome_id, start)")
+        cur.execute ( "CREATE INDEX IF NOT EXISTS idx_transcripts_gene_id ON transcripts(gene_id)")
+        cur.execute ( "CREATE INDEX IF NOT EXISTS idx_transcripts_chromosome_tss ON transcripts(chromosome_id, tss)")
+        build_gene_interval_index(cur)
+        new_gene_load(cur)
+        bump_data_version(cur)
 
-    # Buffers for bulk insertion
-    gene_entries = []
-    transcript_entries = []
-
-    for raw_line in gtf_file.stream:
-        line = raw_line.decode("utf-8").strip()
-        if line.startswith("#"):
-            continue
-        
-        parts = line.split("\t")
-        if len(parts) < 9:
-            continue
-        
-        feature_type = parts[2]
-        chromosome = parts[0]
-        start = int(parts[3])
-        stop = int(parts[4])
-        strand = parts[6]
-        attributes = parts[8]
-
-        if feature_type == "gene":
-            gene_name = extract_attribute(attributes, "gene_name")
-            if gene_name:
-                if strand == "-":
-                    start, stop = stop, start  # Adjust for reverse strand
-                gene_entries.append( (gene_name,chromosome,start,stop ))
-                gene_id_counter += 1  # Increment for the next gene
-
-        elif feature_type == "transcript":
-            transcript_name = extract_attribute(attributes, "transcript_id")
-            if transcript_name:
-                if strand == "-":
-                    start, stop = stop, start  # Adjust for reverse strand
-                transcript_entries.append((gene_id_counter-1 ,transcript_name , start, stop ) )
-    # just for debug!           
-    f_name = os.path.join(pgdata_path, "db_gtf_contents_file.sql" )
-
-
-    # Write COPY commands to the SQL file
-    if gene_entries:
-        cur.executemany(
-            "INSERT INTO genes (gene_name, chromosome, start, stop) VALUES (?, ?, ?, ?)", 
-            gene_entries)
-
-    if transcript_entries:
-        cur.executemany(
-            "INSERT INTO transcripts (gene_id, transcript_name, start, stop)  VALUES (?, ?, ?, ?)", 
-            transcript_entries)
-
-    cur.execute ( "CREATE INDEX IF NOT EXISTS idx_genes_chromosome_start ON genes(chromosome, start)")
-    cur.execute ( "CREATE INDEX IF NOT EXISTS idx_transcripts_gene_id ON transcripts(gene_id)")
-
-    conn.commit()
+        conn.commit()
+    if np is not None:
+        # the new annotation replaces the in-memory gene index and its files right away
+        get_gene_index(conn)
     conn.close()
         
     return "Data successfully loaded and indexes created"
 
 
-def extract_attribute(attributes, key):
-    """Extracts values from a GTF attributes column (e.g., gene_name or transcript_id)."""
-    for attr in attributes.split(";"):
-        attr = attr.strip()
-        if attr.startswith(key):
-            parts = attr.split('"')
-            if len(parts) > 1:
-                return parts[1]
-    return None
-
 # Main entry point for Flask app
 if __name__ == '__main__':
+    conn = db_pool.acquire()
+    ensure_compact_schema(conn)
+    with write_lock:
+        create_bed_indexes(conn.cursor())
+        conn.commit()
+    if np is not None:
+        get_gene_index(conn)
+    conn.close()
+    # before the first request thread exists, so the forkserver starts from a quiet process
+    start_pool()
+    # experiments loaded before the matrix existed; /cooccupancy shows them once computed
+    threading.Thread(target=update_cooccupancy, name="cooccupancy", daemon=True).start()
     app.run(debug=False, host='0.0.0.0', port=5000)
@@ -0,0 +1,237 @@
+"""Columnar NumPy copy of the genes table for vectorized peak-to-gene window lookups."""
+
+import os
+import shutil
+import uuid
+
+import numpy as np
+
+# Directory next to genome.db with one .npy file per column; restarted workers memory-map
+# it instead of reading the genes table again
+GENE_INDEX_DIRNAME = "genes_index"
+
+GENE_INDEX_COLUMNS = (
+    "signature", "chromosomes", "offsets", "reach", "ids", "starts", "stops", "strands", "name_codes", "names",
+    "tss_offsets", "tss", "tss_strands", "tss_genes", "transcript_codes", "transcript_names",
+)
+
+
+# Part of the signature, so index files written with an older meaning of the columns are
+# rebuilt (2: start <= stop on both strands, 3: strands and transcription start sites,
+# 4: signature of the load token only)
+GENE_INDEX_FORMAT = 4
+
+
+def gene_signature(conn):
+    """(format, load token) - changes with every GTF load.
+
+    The load token is a random number stored in summary_counts ('gene_load') whenever the
+    genes change (flask_app.new_gene_load), so an index left over from a deleted genome.db
+    is never taken for a new annotation. Reading it is a single primary key lookup; 0 means
+    the database has no token yet.
+    """
+    row = conn.execute("SELECT count FROM summary_counts WHERE name = 'gene_load'").fetchone()
+    return (GENE_INDEX_FORMAT, row[0] if row else 0)
+
+
+class GeneIndex:
+    """The genes as NumPy columns, grouped by chromosome and sorted by start.
+
+    chromosomes[i] owns the rows offsets[i]:offsets[i + 1] of ids, starts, stops and
+    name_codes; names[name_codes] are the gene names, every name stored once.
+    reach[i] is the longest stop - start on that chromosome, which bounds how far
+    before a window a gene may start and still reach into it.
+
+    The transcription start sites are grouped the same way: chromosomes[i] owns the rows
+    tss_offsets[i]:tss_offsets[i + 1] of tss, tss_strands, tss_genes (the gene row of the
+    transcript) and transcript_codes, sorted by tss.
+    """
+
+    def __init__(self, signature, chromosomes, offsets, reach, ids, starts, stops, strands, name_codes, names,
+                 tss_offsets, tss, tss_strands, tss_genes, transcript_codes, transcript_names):
+        self.signature = tuple(int(value) for value in signature)
+        self.chromosomes = chromosomes
+        self.offsets = offsets
+        self.reach = reach
+        self.ids = ids
+        self.starts = starts
+        self.stops = stops
+        self.strands = strands
+        self.name_codes = name_codes
+        self.names = names
+        self.tss_offsets = tss_offsets
+        self.tss = tss
+        self.tss_strands = tss_strands
+        self.tss_genes = tss_genes
+        self.transcript_codes = transcript_codes
+        self.transcript_names = transcript_names
+        self._positions = {name: i for i, name in enumerate(chromosomes.tolist())}
+
+    @classmethod
+    def from_connection(cls, conn):
+        signature = gene_signature(conn)
+        rows = conn.execute("""
+            SELECT g.id, g.gene_name, c.name, g.start, g.stop, g.strand
+            FROM genes g JOIN chromosomes c ON c.id = g.chromosome_id
+            ORDER BY c.name, g.start""").fetchall()
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        names, name_codes = np.unique(np.array([row[1] for row in rows], dtype=str), return_inverse=True)
+        starts = np.array([row[3] for row in rows], dtype=np.int64)
+        stops = np.array([row[4] for row in rows], dtype=np.int64)
+        strands = np.array([row[5] or "." for row in rows], dtype="U1")
+
+        # rows are ordered by chromosome, so the first row of each chromosome is where it begins
+        chromosomes, first_rows = np.unique(np.array([row[2] for row in rows], dtype=str), return_index=True)
+        offsets = np.append(first_rows, len(rows)).astype(np.int64)
+        reach = np.array([max(int((stops[lo:hi] - starts[lo:hi]).max()), 0) for lo, hi in zip(offsets, offsets[1:])],
+                         dtype=np.int64)
+
+        # only transcripts of a gene in the index, so every gene id below is found in ids
+        transcripts = conn.execute("""
+            SELECT c.name, t.tss, t.strand, t.gene_id, t.transcript_name
+            FROM transcripts t
+            JOIN genes g ON g.id = t.gene_id
+            JOIN chromosomes c ON c.id = t.chromosome_id
+            ORDER BY c.name, t.tss""").fetchall()
+        tss_offsets = np.searchsorted(np.array([row[0] for row in transcripts], dtype=str),
+                                      np.append(chromosomes, "\U0010ffff"), side="left").astype(np.int64)
+        tss = np.array([row[1] for row in transcripts], dtype=np.int64)
+        tss_strands = np.array([row[2] or "." for row in transcripts], dtype="U1")
+        by_id = np.argsort(ids)
+        tss_genes = by_id[np.searchsorted(ids[by_id], np.array([row[3] for row in transcripts], dtype=np.int64))]
+        transcript_names, transcript_codes = np.unique(np.array([row[4] for row in transcripts], dtype=str),
+                                                       return_inverse=True)
+
+        return cls(signature, chromosomes, offsets, reach, ids, starts, stops, strands,
+                   name_codes.astype(np.int32), names, tss_offsets, tss, tss_strands, tss_genes.astype(np.int64),
+                   transcript_codes.astype(np.int32), transcript_names)
+
+    @classmethod
+    def load(cls, path):
+        """Memory-maps the columns saved in the directory path; None if it is missing.
+
+        The pages are shared with every other process mapping the same files, and only
+        the parts a request touches are read from disk.
+        """
+        try:
+            return cls(*[np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r", allow_pickle=False)
+                         for column in GENE_INDEX_COLUMNS])
+        except FileNotFoundError:
+            # not saved yet, or replaced by another process right now
+            return None
+
+    def save(self, path):
+        # written to a temporary directory first and then swapped in, so a concurrent load
+        # never sees half an index; processes mapping the old files keep reading them
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(tmp_path)
+        for column in GENE_INDEX_COLUMNS:
+            value = np.array(self.signature, dtype=np.int64) if column == "signature" else getattr(self, column)
+            np.save(os.path.join(tmp_path, f"{column}.npy"), value, allow_pickle=False)
+        old_path = f"{path}.{uuid.uuid4().hex}.old"
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        # the single .npz file of earlier versions
+        if os.path.exists(f"{path}.npz"):
+            os.remove(f"{path}.npz")
+
+    def chromosome_list(self):
+        return self.chromosomes.tolist()
+
+    def window_matches(self, chromosome, peak_starts, peak_stops, distance):
+        """Finds the genes with start - distance <= peak stop and stop + distance >= peak start.
+
+        peak_starts and peak_stops are int64 arrays of the peaks on chromosome. Returns
+        (peak positions, gene rows) as two arrays of the same length, ordered by gene start.
+        """
+        position = self._positions.get(chromosome)
+        if position is None or len(peak_starts) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        first, last = self.offsets[position], self.offsets[position + 1]
+        starts = self.starts[first:last]
+        stops = self.stops[first:last]
+
+        # candidate genes per peak are a contiguous range of the start sorted columns
+        left = np.searchsorted(starts, peak_starts - distance - self.reach[position], side="left")
+        right = np.searchsorted(starts, peak_stops + distance, side="right")
+        counts = np.maximum(right - left, 0)
+        peaks = np.repeat(np.arange(len(peak_starts)), counts)
+        genes = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(left, counts)
+
+        keep = stops[genes] + distance >= peak_starts[peaks]
+        peaks, genes = peaks[keep], genes[keep]
+        order = np.argsort(genes, kind="stable")
+        return peaks[order], genes[order] + first
+
+    def nearest(self, chromosome, peak_starts, peak_stops, k, tss=False):
+        """Finds the k genes closest to each peak, or with tss=True the k genes with the closest TSS.
+
+        The distance is 0 for overlaps, otherwise the gap between the peak and the gene body
+        (or TSS); with tss=True every gene counts once, through its closest transcript.
+        Each peak starts with a search radius that holds about k genes at the average gene
+        density of the chromosome and doubles it until k genes are within the radius, so a
+        peak in a gene desert costs a few more binary searches rather than a scan.
+        Returns (peak positions, rows, distances, ranks) ordered by peak position and rank;
+        rows are gene rows, or transcript rows with tss=True.
+        """
+        position = self._positions.get(chromosome)
+        empty = np.zeros(0, dtype=np.int64)
+        if position is None or len(peak_starts) == 0:
+            return empty, empty, empty, empty
+        if tss:
+            first, last = self.tss_offsets[position], self.tss_offsets[position + 1]
+            starts = stops = self.tss[first:last]
+            reach = 0
+            genes = self.tss_genes[first:last]
+        else:
+            first, last = self.offsets[position], self.offsets[position + 1]
+            starts = self.starts[first:last]
+            stops = self.stops[first:last]
+            reach = self.reach[position]
+            genes = None
+        count = last - first
+        if count == 0:
+            return empty, empty, empty, empty
+
+        radius = np.full(len(peak_starts), max(1, int(starts[-1] - starts[0]) * k // count), dtype=np.int64)
+        pending = np.arange(len(peak_starts))
+        found = []
+        while len(pending):
+            peak_start, peak_stop, peak_radius = peak_starts[pending], peak_stops[pending], radius[pending]
+            # every gene within the radius starts in this range of the start sorted columns
+            left = np.searchsorted(starts, peak_start - peak_radius - reach, side="left")
+            right = np.searchsorted(starts, peak_stop + peak_radius, side="right")
+            counts = right - left
+            peaks = np.repeat(np.arange(len(pending)), counts)
+            rows = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(left, counts)
+            distances = np.maximum(np.maximum(starts[rows] - peak_stop[peaks], peak_start[peaks] - stops[rows]), 0)
+
+            within = distances <= peak_radius[peaks]
+            peaks, rows, distances = peaks[within], rows[within], distances[within]
+            if genes is not None:
+                # keep the closest transcript of every gene
+                order = np.lexsort((distances, genes[rows], peaks))
+                peaks, rows, distances = peaks[order], rows[order], distances[order]
+                first_of_gene = np.ones(len(peaks), dtype=bool)
+                first_of_gene[1:] = (peaks[1:] != peaks[:-1]) | (genes[rows[1:]] != genes[rows[:-1]])
+                peaks, rows, distances = peaks[first_of_gene], rows[first_of_gene], distances[first_of_gene]
+
+            # a peak is done with k genes in its radius, or when the radius covers the chromosome
+            done = (np.bincount(peaks, minlength=len(pending)) >= k) | ((left == 0) & (right == count))
+            finished = done[peaks]
+            peaks, rows, distances = peaks[finished], rows[finished], distances[finished]
+            order = np.lexsort((starts[rows], distances, peaks))
+            peaks, rows, distances = peaks[order], rows[order], distances[order]
+            ranks = np.arange(len(peaks)) - np.searchsorted(peaks, peaks, side="left")
+            best = ranks < k
+            found.append((pending[peaks[best]], rows[best] + first, distances[best], ranks[best] + 1))
+
+            pending = pending[~done]
+            radius[pending] *= 2
+
+        peaks, rows, distances, ranks = (np.concatenate(column) for column in zip(*found))
+        order = np.lexsort((ranks, peaks))
+        return peaks[order], rows[order], distances[order], ranks[order]
@@ -0,0 +1,109 @@
+"""Streaming GTF parser shared by the Flask upload (flask_app.py) and the CLI loader (load_gtf.py)."""
+
+import re
+from collections import namedtuple
+
+# Only these features end up in the database - exon, CDS, UTR ... lines are skipped
+# before their attribute column is looked at
+GTF_FEATURES = ('gene', 'transcript')
+
+# Number of genes + transcripts handed to the database in one go
+GTF_BATCH_SIZE = 50000
+
+# One 'key "value";' pair of the attribute column. The key has to start the column or
+# follow a ';', so 'gene_name' never matches 'gene_name_alt' or the tail of another key.
+ATTRIBUTE_RE = re.compile(r'(?:^|;)\s*(\w+) "([^"]*)"')
+
+GtfRecord = namedtuple('GtfRecord', ['feature', 'chromosome', 'start', 'stop', 'strand', 'gene_id', 'name'])
+
+
+def extract_attributes(attributes, keys):
+    """Returns {key: value} for the requested keys in one scan over the attribute column.
+
+    The scan stops as soon as all keys are found; the first occurrence of a key wins.
+    """
+    found = {}
+    for match in ATTRIBUTE_RE.finditer(attributes):
+        key = match.group(1)
+        if key in keys and key not in found:
+            found[key] = match.group(2)
+            if len(found) == len(keys):
+                break
+    return found
+
+
+def extract_attribute(attributes, key):
+    """Extracts one value from a GTF attributes column (e.g., gene_name or transcript_id)."""
+    return extract_attributes(attributes, (key,)).get(key)
+
+
+def parse_gtf(lines):
+    """Yields a GtfRecord for every gene and transcript line of a GTF.
+
+    lines can be any iterable of str or bytes lines (an open file, a werkzeug upload stream).
+    name is the gene_name for genes and the transcript_id for transcripts; records without
+    a name are skipped.
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if line.startswith('#'):
+            continue
+        parts = line.rstrip('\r\n').split('\t', 8)
+        if len(parts) < 9 or parts[2] not in GTF_FEATURES:
+            continue
+
+        feature = parts[2]
+        name_key = 'gene_name' if feature == 'gene' else 'transcript_id'
+        attributes = extract_attributes(parts[8], ('gene_id', name_key))
+        name = attributes.get(name_key)
+        if name:
+            yield GtfRecord(feature, parts[0], int(parts[3]), int(parts[4]), parts[6],
+                            attributes.get('gene_id'), name)
+
+
+def iter_gtf_batches(lines, first_gene_id=1, batch_size=GTF_BATCH_SIZE):
+    """Yields (gene_rows, transcript_rows) batches ready for insertion.
+
+    gene_rows are (id, gene_name, chromosome, start, stop, strand) with ids counted up
+    from first_gene_id; transcript_rows are (gene_id, transcript_name, chromosome, start,
+    stop, strand, tss) and are linked to their gene through the gene_id attribute and the
+    chromosome, not through the line order. start <= stop on both strands; the
+    transcription start site tss is the start of plus strand and the stop of minus strand
+    transcripts.
+
+    Ids are only handed out to gene lines, so a gene_id used on two chromosomes (PAR genes
+    on chrX and chrY) gives two genes. Transcripts are held back until their gene line has
+    been seen; those of genes that are never yielded (e.g. without a gene_name) are dropped.
+    Only the current batch, held back transcripts and the gene map are kept in memory.
+    """
+    gene_ids = {}
+    waiting = {}
+    next_gene_id = first_gene_id
+    gene_rows = []
+    transcript_rows = []
+
+    for record in parse_gtf(lines):
+        key = (record.gene_id, record.chromosome)
+        if record.feature == 'gene':
+            gene_id = gene_ids[key] = next_gene_id
+            next_gene_id += 1
+            gene_rows.append((gene_id, record.name, record.chromosome, record.start, record.stop, record.strand))
+            # transcripts listed before their gene
+            transcript_rows.extend((gene_id,) + row for row in waiting.pop(key, ()))
+        else:
+            tss = record.stop if record.strand == '-' else record.start
+            row = (record.name, record.chromosome, record.start, record.stop, record.strand, tss)
+            gene_id = gene_ids.get(key)
+            if gene_id is None:
+                waiting.setdefault(key, []).append(row)
+            else:
+                transcript_rows.append((gene_id,) + row)
+
+        if len(gene_rows) + len(transcript_rows) >= batch_size:
+            yield gene_rows, transcript_rows
+            gene_rows = []
+            transcript_rows = []
+
+    if gene_rows or transcript_rows:
+        yield gene_rows, transcript_rows
@@ -0,0 +1,62 @@
+"""Opening of BED/GTF inputs, plain text or gzip/bgzip compressed, as binary line streams."""
+
+import gzip
+import hashlib
+
+# First two bytes of every gzip member; bgzip files are a series of gzip members
+GZIP_MAGIC = b'\x1f\x8b'
+
+# File name suffixes that are stripped before the file type is checked
+COMPRESSED_SUFFIXES = ('.gz', '.bgz')
+
+# Bytes read at a time when a file is hashed or copied
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def strip_compression_suffix(filename):
+    """'peaks.bed.gz' -> 'peaks.bed'"""
+    lower = filename.lower()
+    for suffix in COMPRESSED_SUFFIXES:
+        if lower.endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+
+def open_input(source):
+    """Returns a binary stream over the uncompressed content of source.
+
+    source is a binary file-like object (an open 'rb' file or the stream of a werkzeug upload)
+    that can either peek or seek. Compression is detected from the magic bytes, not the file
+    name, and the data is decompressed while it is read - nothing is written to disk.
+    """
+    if hasattr(source, 'peek'):
+        magic = source.peek(2)[:2]
+    else:
+        magic = source.read(2)
+        source.seek(0)
+
+    if magic == GZIP_MAGIC:
+        # GzipFile reads multi-member (bgzip) files as one continuous stream
+        return gzip.GzipFile(fileobj=source, mode='rb')
+    return source
+
+
+def copy_and_hash(source, target, chunk_size=HASH_CHUNK_SIZE):
+    """Copies the binary stream source to target and returns the SHA-256 hex digest of its bytes.
+
+    The hash is of the file as it was uploaded (compressed or not), computed while it is copied.
+    """
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: source.read(chunk_size), b''):
+        digest.update(chunk)
+        target.write(chunk)
+    return digest.hexdigest()
+
+
+def hash_file(path, chunk_size=HASH_CHUNK_SIZE):
+    """SHA-256 hex digest of the file at path, read in chunks (the same value as copy_and_hash)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,156 @@
+"""In-process job queue for BED/GTF ingestion - uploads are spooled and loaded by worker threads."""
+
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of uploads that are parsed at the same time. Parsing overlaps, the database
+# writes themselves are serialized by db_pool.write_lock.
+INGEST_WORKERS = 2
+
+# Finished jobs kept for the status endpoints
+MAX_FINISHED_JOBS = 100
+
+
+class JobSkipped(Exception):
+    """Raised by a job function that had nothing to do, e.g. for a file that is already loaded."""
+
+
+class ProgressReader:
+    """Binary file wrapper that reports how many bytes have been read so far."""
+
+    def __init__(self, raw, callback):
+        self._raw = raw
+        self._callback = callback
+        self._position = 0
+
+    def _advance(self, data):
+        self._position += len(data)
+        self._callback(self._position)
+        return data
+
+    def read(self, size=-1):
+        return self._advance(self._raw.read(size))
+
+    def readline(self, size=-1):
+        return self._advance(self._raw.readline(size))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._position = self._raw.seek(offset, whence)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self._raw.close()
+
+
+class Job:
+    def __init__(self, job_id, kind, description, path):
+        self.id = job_id
+        self.kind = kind
+        self.description = description
+        self.path = path
+        self.status = "queued"
+        self.total_bytes = os.path.getsize(path)
+        self.bytes_read = 0
+        self.rows = None
+        self.message = ""
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def progress(self):
+        if self.status in ("done", "skipped"):
+            return 1.0
+        return self.bytes_read / self.total_bytes if self.total_bytes else 0.0
+
+    def set_bytes_read(self, bytes_read):
+        self.bytes_read = bytes_read
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "description": self.description,
+            "status": self.status,
+            "progress": round(self.progress, 4),
+            "bytes_read": self.bytes_read,
+            "total_bytes": self.total_bytes,
+            "rows": self.rows,
+            "message": self.message,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class JobQueue:
+    """Runs ingestion functions on spooled files in a local thread pool.
+
+    func(path, progress_callback, *args) is run for every submitted job; it returns the
+    number of rows loaded, raises JobSkipped if there was nothing to load and raises on
+    errors. The spooled file is removed afterwards.
+    """
+
+    def __init__(self, workers=INGEST_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, kind, description, path, func, *args):
+        with self._lock:
+            job = Job(next(self._ids), kind, description, path)
+            self._jobs[job.id] = job
+            self._forget_old_jobs()
+        self._executor.submit(self._run, job, func, args)
+        return job
+
+    def _run(self, job, func, args):
+        job.status = "running"
+        job.started = time.time()
+        try:
+            job.rows = func(job.path, job.set_bytes_read, *args)
+            job.status = "done"
+        except JobSkipped as e:
+            job.rows = 0
+            job.status = "skipped"
+            job.message = str(e)
+        except Exception as e:
+            job.status = "failed"
+            job.message = str(e)
+        finally:
+            job.finished = time.time()
+            try:
+                os.remove(job.path)
+            except OSError:
+                pass
+
+    def _forget_old_jobs(self):
+        finished = [job for job in self._jobs.values() if job.finished is not None]
+        for job in sorted(finished, key=lambda job: job.finished)[:-MAX_FINISHED_JOBS]:
+            del self._jobs[job.id]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.id, reverse=True)
+
+    def active(self):
+        return any(job.status in ("queued", "running") for job in self.jobs())
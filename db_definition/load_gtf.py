@@ -1,83 +1,79 @@
 #!/usr/bin/env python3
 
-import os
+import io
 import psycopg2
 import argparse
 
+from gtf_parser import iter_gtf_batches
+from input_streams import open_input
+
 def create_connection(password):
     conn = psycopg2.connect(dbname='genome_db', user='postgres', password=password, host='localhost')
     return conn
 
+def copy_escape(value):
+    # Escape a value for the PostgreSQL COPY text format
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+def copy_rows(cur, table, columns, rows):
+    """Sends rows to table with one COPY FROM STDIN."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(copy_escape(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+def chromosome_ids(cur, names):
+    """Returns {name: id} of the chromosomes table after adding the names not in it yet.
+
+    genes and transcripts store the chromosome id, like the tables of the Flask app.
+    """
+    cur.execute("SELECT name, id FROM chromosomes")
+    ids = dict(cur.fetchall())
+    next_id = max(ids.values(), default=0) + 1
+    new = [(next_id + n, name) for n, name in enumerate(sorted(set(names) - ids.keys()))]
+    if new:
+        cur.executemany("INSERT INTO chromosomes (id, name) VALUES (%s, %s) ON CONFLICT (name) DO NOTHING", new)
+        cur.execute("SELECT name, id FROM chromosomes")
+        ids = dict(cur.fetchall())
+    return ids
+
 def load_gtf_to_postgres(gtf_file, password):
     conn = create_connection(password)
     cur = conn.cursor()
 
-    cur.execute( f" INSERT INTO info ( info ) VALUES ( 'gene info from {gtf_file}' )" )
-    # Process GTF file into genes and transcripts
-    gene_data = []
-    transcript_data = []
-
-    with open(gtf_file, 'r') as gtf:
-        for line in gtf:
-            if line.startswith('#'):
-                continue
-            parts = line.strip().split('\t')
-            if parts[2] == 'gene':
-                # Extract gene data
-                gene_info = {
-                    'gene_name': parts[8].split('gene_name "')[1].split('"')[0],
-                    'chromosome': parts[0],
-                    'start': int(parts[3]),
-                    'stop': int(parts[4]),
-                    'strand': parts[6]
-                }
-
-                # Adjust gene orientation if necessary (based on strand)
-                if gene_info['strand'] == '-':
-                    gene_info['start'], gene_info['stop'] = gene_info['stop'], gene_info['start']
-
-                gene_data.append(gene_info)
-
-            elif parts[2] == 'transcript':
-                # Extract transcript data
-                transcript_info = {
-                    'transcript_name': parts[8].split('transcript_id "')[1].split('"')[0],
-                    'chromosome': parts[0],
-                    'start': int(parts[3]),
-                    'stop': int(parts[4]),
-                    'strand': parts[6]
-                }
-
-                # Adjust transcript position based on strand (gene orientation)
-                if transcript_info['strand'] == '-':
-                    transcript_info['start'], transcript_info['stop'] = transcript_info['stop'], transcript_info['start']
-
-                transcript_data.append(transcript_info)
-
-    # Insert genes into the database
-    for gene in gene_data:
-        cur.execute("""
-            INSERT INTO genes (gene_name, chromosome, start, stop) 
-            VALUES (%s, %s, %s, %s) RETURNING id
-        """, (gene['gene_name'], gene['chromosome'], gene['start'], gene['stop']))
-        gene_id = cur.fetchone()[0]
-
-        # Insert transcripts linked to the gene_id
-        for transcript in transcript_data:
-            # Insert transcript into the database
-            cur.execute("""
-                INSERT INTO transcripts (gene_id, transcript_name,  start, stop) 
-                VALUES (%s, %s, %s, %s)
-            """, (gene_id, transcript['transcript_name'], transcript['start'], transcript['stop']))
-
-    conn.commit()
-
-    # Create indexes on chromosome, start, and stop for efficient querying
+    cur.execute("INSERT INTO info ( info ) VALUES ( %s )", (f'gene info from {gtf_file}',))
+
+    # Gene ids are assigned by the parser, so transcripts are linked to their gene through
+    # the gene_id attribute without a RETURNING round trip per gene
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM genes")
+    next_gene_id = cur.fetchone()[0] + 1
+
+    # Each parser batch is sent with one COPY per table
+    # gzip/bgzip compressed GTFs are decompressed while they are read
+    with open(gtf_file, 'rb') as gtf:
+        for gene_batch, transcript_batch in iter_gtf_batches(open_input(gtf), next_gene_id):
+            # the parser gives chromosome names (third column of both); rows store their id
+            ids = chromosome_ids(cur, {row[2] for row in gene_batch} | {row[2] for row in transcript_batch})
+            if gene_batch:
+                copy_rows(cur, 'genes', ('id', 'gene_name', 'chromosome_id', 'start', 'stop', 'strand'),
+                          (row[:2] + (ids[row[2]],) + row[3:] for row in gene_batch))
+                next_gene_id = max(next_gene_id, max(row[0] for row in gene_batch) + 1)
+            if transcript_batch:
+                copy_rows(cur, 'transcripts', ('gene_id', 'transcript_name', 'chromosome_id', 'start', 'stop', 'strand', 'tss'),
+                          (row[:2] + (ids[row[2]],) + row[3:] for row in transcript_batch))
+
+    # The ids were set explicitly, so move the serial sequence past them
+    cur.execute("SELECT setval(pg_get_serial_sequence('genes', 'id'), %s, false)", (next_gene_id,))
+
+    # Create the indexes of the Flask app on chromosome id and position after the bulk load
     cur.execute("""
-    CREATE INDEX IF NOT EXISTS idx_genes_chromosome_start_end ON genes(chromosome, start, stop);
-    CREATE INDEX IF NOT EXISTS idx_genes_chromosome_start ON genes(chromosome, start );
-    CREATE INDEX IF NOT EXISTS idx_gene ON transcripts( gene_id );
+    CREATE INDEX IF NOT EXISTS idx_genes_chromosome_start ON genes( chromosome_id, start );
+    CREATE INDEX IF NOT EXISTS idx_transcripts_gene_id ON transcripts( gene_id );
+    CREATE INDEX IF NOT EXISTS idx_transcripts_chromosome_tss ON transcripts( chromosome_id, tss );
     """)
+    conn.commit()
 
     cur.close()
     conn.close()
@@ -85,7 +81,7 @@ def load_gtf_to_postgres(gtf_file, password):
 def main():
     # Setup command-line argument parser
     parser = argparse.ArgumentParser(description="Load GTF data into PostgreSQL database")
-    parser.add_argument('gtf_file', help="Path to the GTF file to load")
+    parser.add_argument('gtf_file', help="Path to the GTF file to load (plain or gzip/bgzip compressed)")
     parser.add_argument('--password', help="Password for the database - is uniqe to each apptainer image")
 
     # Parse the arguments
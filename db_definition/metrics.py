@@ -0,0 +1,298 @@
+"""In-process request, SQL, parser and download metrics in the Prometheus text format.
+
+The counters live in the server process and are exported at /metrics; they start from
+zero on every restart, which Prometheus rate() handles. Requests can also be run under
+cProfile (see start_profile), one at a time.
+"""
+
+import cProfile
+import functools
+import sqlite3
+import threading
+import time
+
+# Seconds; from a cached page load to a whole-genome download
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# Rows per download
+ROW_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+INF_BUCKET = 'le="+Inf"'
+
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named family of samples, one per combination of label values."""
+
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_sample(key, value) for key, value in items)
+        return "\n".join(lines)
+
+    def _render_sample(self, key, value):
+        return f"{self.name}{format_labels(self.labelnames, key)} {format_number(value)}"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            sample = self._values.get(key)
+            if sample is None:
+                # per bucket counts (not cumulative), then sum and count
+                sample = self._values[key] = [[0] * len(self.buckets), 0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample[0][i] += 1
+                    break
+            sample[1] += value
+            sample[2] += 1
+
+    def _render_sample(self, key, sample):
+        counts, total, count = sample
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = format_labels(self.labelnames, key, f'le="{format_number(bound)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, INF_BUCKET)} {count}")
+        lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {format_number(total)}")
+        lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {count}")
+        return "\n".join(lines)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.add(Histogram(
+    "http_request_duration_seconds",
+    "Time from the start of a request until its response (streamed downloads included) is sent.",
+    ("route", "method", "status")))
+
+SQL_SECONDS = REGISTRY.add(Histogram(
+    "sqlite_statement_duration_seconds",
+    "Time spent in execute/executemany/executescript by statement type, and in fetching rows (fetch).",
+    ("statement",)))
+
+PARSER_ROWS = REGISTRY.add(Counter(
+    "parser_rows_total", "Rows produced by the BED and GTF parsers.", ("format",)))
+
+PARSER_SECONDS = REGISTRY.add(Counter(
+    "parser_seconds_total", "Time spent parsing BED and GTF input (including decompression).", ("format",)))
+
+PARSER_ROWS_PER_SECOND = REGISTRY.add(Gauge(
+    "parser_last_rows_per_second", "Parse rate of the most recently loaded file.", ("format",)))
+
+DOWNLOAD_ROWS = REGISTRY.add(Histogram(
+    "download_rows", "Rows streamed per download that was not served from the result cache.",
+    ("download", "format"), buckets=ROW_BUCKETS))
+
+RESULT_CACHE_REQUESTS = REGISTRY.add(Counter(
+    "result_cache_requests_total", "Downloads answered from the result cache (hit) or computed (miss).",
+    ("download", "result")))
+
+INGEST_JOB_SECONDS = REGISTRY.add(Histogram(
+    "ingest_job_duration_seconds", "Time to load an uploaded BED or GTF file.", ("kind", "status")))
+
+
+def record_parse(file_format, rows, seconds):
+    PARSER_ROWS.inc(rows, format=file_format)
+    PARSER_SECONDS.inc(seconds, format=file_format)
+    if seconds > 0:
+        PARSER_ROWS_PER_SECOND.set(rows / seconds, format=file_format)
+
+
+def iter_timed_parse(file_format, batches, count):
+    """Passes the batches of a parser through and records their rows and the time taken to parse them.
+
+    count(batch) is the number of rows of a batch. Only the time spent inside the parser is
+    counted, not the time the caller spends on a batch before it asks for the next one.
+    """
+    rows = 0
+    seconds = 0.0
+    try:
+        while True:
+            started = time.perf_counter()
+            batch = next(batches, None)
+            seconds += time.perf_counter() - started
+            if batch is None:
+                break
+            rows += count(batch)
+            yield batch
+    finally:
+        record_parse(file_format, rows, seconds)
+
+
+def iter_download_rows(first, chunks, **labels):
+    """Yields the row list first and then those of chunks; records the number of rows once the download ends."""
+    rows = len(first)
+    try:
+        yield first
+        for chunk in chunks:
+            rows += len(chunk)
+            yield chunk
+    finally:
+        DOWNLOAD_ROWS.observe(rows, **labels)
+        # make sure the cursor is released if the client goes away mid download
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
+
+
+@functools.lru_cache(maxsize=1024)
+def statement_type(sql):
+    """The leading keyword of a statement (select, insert, create ...), the label of SQL_SECONDS."""
+    words = sql.split(None, 1)
+    return words[0].lower() if words else "empty"
+
+
+class TimedCursor(sqlite3.Cursor):
+    """sqlite3 cursor that records the time of its statements in SQL_SECONDS.
+
+    Rows read by iterating over the cursor are not timed, only fetchone/fetchmany/fetchall.
+    """
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            SQL_SECONDS.observe(time.perf_counter() - started, statement=statement_type(sql))
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            SQL_SECONDS.observe(time.perf_counter() - started, statement=statement_type(sql))
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            SQL_SECONDS.observe(time.perf_counter() - started, statement="script")
+
+    def _timed_fetch(self, fetch, *args):
+        started = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            SQL_SECONDS.observe(time.perf_counter() - started, statement="fetch")
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection (factory of sqlite3.connect) whose cursors are TimedCursors."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+# cProfile allows one active profiler at a time, so requests are profiled one after the other
+_profile_lock = threading.Lock()
+
+
+def start_profile():
+    """Returns an enabled cProfile.Profile, or None while another request is being profiled."""
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except Exception:
+        _profile_lock.release()
+        raise
+    return profile
+
+
+def stop_profile(profile, path):
+    """Stops a profile of start_profile and writes it to path (readable with pstats or snakeviz)."""
+    try:
+        profile.disable()
+        profile.dump_stats(path)
+    finally:
+        _profile_lock.release()
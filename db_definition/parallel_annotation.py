@@ -0,0 +1,111 @@
+"""Runs independent read-only queries in a process pool and returns their rows in task order."""
+
+import collections
+import multiprocessing
+import multiprocessing.util
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Tasks in flight per worker; bounds how many finished results wait for an earlier one
+TASKS_PER_WORKER = 2
+
+# Rows a worker returns per task; a longer result is continued by the task resume returns
+ROWS_PER_RESULT = 50000
+
+# The process pool shared by all requests of this process, see start_pool
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def run_read_only_query(db_path, sql, params, max_rows):
+    """Worker side: runs one query on its own read-only connection and returns up to max_rows rows."""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        conn.execute("PRAGMA mmap_size=1073741824")
+        return conn.execute(sql, params).fetchmany(max_rows)
+    finally:
+        conn.close()
+
+
+def start_pool(workers=None):
+    """Returns the shared process pool, starting it with workers processes (default: all cores).
+
+    The pool lives as long as the process and is reused by every request. Its workers come
+    from a forkserver, never from a fork of the threaded web server, and are started once
+    instead of per request.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None:
+            _pool_workers = workers or os.cpu_count() or 1
+            context = multiprocessing.get_context("forkserver")
+            _pool = ProcessPoolExecutor(max_workers=_pool_workers, mp_context=context)
+            # multiprocessing joins all child processes on exit, also in processes it started
+            # itself where atexit does not run. Its finalizers run before that join, highest
+            # priority first: stop the workers while the pool's queues (priority 10) still work
+            multiprocessing.util.Finalize(None, shutdown_pool, exitpriority=100)
+        return _pool
+
+
+def shutdown_pool():
+    """Stops the workers of the shared pool; a later request starts a new one."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+
+def discard_pool(pool):
+    """Drops a broken pool so the next request starts a new one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_ordered_query_results(db_path, tasks, resume, workers=None, max_rows=None):
+    """Yields the rows of each (sql, params) task, in the order of tasks.
+
+    A worker returns at most max_rows (default: ROWS_PER_RESULT) rows of a task; for a full result
+    resume(sql, params, last_row) gives the (sql, params) task of the rows after last_row,
+    which runs before any later task is yielded. The queries run on the shared pool, up to
+    workers (default: its size) of them at the same time; a result is only held back while
+    an earlier task is still running, so memory stays bounded by the tasks in flight times
+    max_rows.
+    """
+    pool = start_pool()
+    workers = min(workers or _pool_workers, _pool_workers)
+    max_rows = max_rows or ROWS_PER_RESULT
+    pending = collections.deque()
+
+    def submit(task):
+        return task, pool.submit(run_read_only_query, db_path, *task, max_rows)
+
+    def next_result():
+        (sql, params), future = pending.popleft()
+        rows = future.result()
+        if len(rows) == max_rows:
+            pending.appendleft(submit(resume(sql, params, rows[-1])))
+        return rows
+
+    try:
+        for task in tasks:
+            pending.append(submit(task))
+            while len(pending) >= workers * TASKS_PER_WORKER:
+                yield next_result()
+        while pending:
+            yield next_result()
+    except BrokenProcessPool:
+        # a worker died (e.g. killed by the OOM killer); the pool cannot be used any more
+        discard_pool(pool)
+        raise
+    finally:
+        # the consumer went away early: do not start the remaining queries
+        for _, future in pending:
+            future.cancel()
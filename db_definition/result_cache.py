@@ -0,0 +1,129 @@
+"""On-disk LRU cache of nearby-gene downloads (gzip compressed TSV or Arrow/Parquet)."""
+
+import hashlib
+import json
+import os
+import threading
+import uuid
+import zlib
+
+# Total size of the cached files; the least recently used ones are removed above it
+RESULT_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# File extension of the cached results per download format; TSV is stored gzip compressed
+CACHE_SUFFIXES = {"tsv": ".tsv.gz", "arrow": ".arrow", "parquet": ".parquet"}
+
+
+def gzip_chunks(chunks):
+    """Gzip compresses a stream of byte chunks on the fly."""
+    # wbits 31 = deflate with a gzip header and trailer
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class ResultCache:
+    """Stores each result as v<data version>_<key hash><format extension> in directory.
+
+    The data version can be any string without '_' (see flask_app.get_data_version).
+
+    The data version is part of the key, so results computed before a BED/GTF load are
+    never served afterwards; files of older versions are removed as soon as a newer
+    version is seen. File modification times record the last use for the LRU eviction.
+    """
+
+    def __init__(self, directory, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._version = None
+
+    def key(self, version, format, **params):
+        """The file name of a result: format is one of CACHE_SUFFIXES, params identify it."""
+        params["format"] = format
+        digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+        return f"v{version}_{digest[:32]}{CACHE_SUFFIXES[format]}"
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        suffixes = tuple(CACHE_SUFFIXES.values())
+        return [entry for entry in os.scandir(self.directory)
+                if entry.name.endswith(suffixes) and not entry.name.startswith(".")]
+
+    def _drop_old_versions(self, version):
+        if self._version == version:
+            return
+        with self._lock:
+            for entry in self._entries():
+                if not entry.name.startswith(f"v{version}_"):
+                    os.remove(entry.path)
+            self._version = version
+
+    def open(self, key, version):
+        """Returns an open binary file of the cached result or None; marks the entry as used."""
+        self._drop_old_versions(version)
+        path = self._path(key)
+        try:
+            cached = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return cached
+
+    def store(self, key, chunks, compressed):
+        """Passes chunks through unchanged while writing them to the cache.
+
+        chunks are TSV bytes, or bytes stored as they are if compressed is True (gzip
+        compressed TSV, Arrow or Parquet). The entry only
+        becomes visible once the stream has been consumed completely, so an aborted
+        download never leaves a truncated result behind. A result larger than the whole
+        cache is not kept: writing stops as soon as it passes max_bytes.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = os.path.join(self.directory, f".{key}.{uuid.uuid4().hex}.tmp")
+        compressor = None if compressed else zlib.compressobj(6, zlib.DEFLATED, 31)
+        complete = False
+        tmp = open(tmp_path, "wb")
+        written = 0
+        try:
+            for chunk in chunks:
+                if tmp is not None:
+                    data = compressor.compress(chunk) if compressor else chunk
+                    tmp.write(data)
+                    written += len(data)
+                    if written > self.max_bytes:
+                        # too large to cache; the rest is only sent
+                        tmp.close()
+                        tmp = None
+                        os.remove(tmp_path)
+                yield chunk
+            if tmp is not None:
+                if compressor:
+                    tmp.write(compressor.flush())
+                tmp.close()
+                tmp = None
+                os.replace(tmp_path, self._path(key))
+                complete = True
+                self._evict()
+        finally:
+            if tmp is not None:
+                tmp.close()
+            if not complete and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _evict(self):
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+            total = sum(entry.stat().st_size for entry in entries)
+            for entry in entries:
+                if total <= self.max_bytes:
+                    break
+                total -= entry.stat().st_size
+                os.remove(entry.path)
@@ -1,47 +1,65 @@
 -- Table for storing experiments (e.g., ChIP-seq experiments)
+-- No AUTOINCREMENT: an INTEGER PRIMARY KEY is assigned the next id all the same,
+-- without the extra sqlite_sequence update per insert
 
 CREATE TABLE experiments (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,              -- Experiment ID
+    id INTEGER PRIMARY KEY,             -- Experiment ID
     experiment_name TEXT NOT NULL,       -- Name of the experiment (e.g., "ChIP-seq experiment 1")
     description TEXT                    -- Description of the experiment
 );
 
 CREATE Table info (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,              -- info ID
+    id INTEGER PRIMARY KEY,             -- info ID
     info TEXT
 );
 
+-- Chromosome dictionary: every other table stores the small integer id instead of the name
+CREATE TABLE chromosomes (
+    id INTEGER PRIMARY KEY,             -- Chromosome ID
+    name TEXT NOT NULL UNIQUE           -- Chromosome name as in the GTF/BED files (e.g., "chr6")
+);
+
 
 -- Table for storing genes
 CREATE TABLE genes (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,              -- Gene ID
+    id INTEGER PRIMARY KEY,             -- Gene ID
     gene_name TEXT NOT NULL,            -- Gene name (e.g., "BRCA1")
-    chromosome TEXT NOT NULL,           -- Chromosome where the gene is located
-    start INT,                          -- Start position of the gene
-    stop INT                             -- End position of the gene
+    chromosome_id INT NOT NULL,         -- Chromosome where the gene is located (chromosomes.id)
+    start INT,                          -- Start position of the gene (start <= stop on both strands)
+    stop INT,                            -- End position of the gene
+    strand TEXT                         -- '+' or '-'
 );
 
 -- Table for storing transcripts (linked to genes, with alternative start and stop positions)
 CREATE TABLE transcripts (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,              -- Transcript ID (for different isoforms)
+    id INTEGER PRIMARY KEY,             -- Transcript ID (for different isoforms)
     gene_id INT NOT NULL,               -- Foreign key linking to genes table
     transcript_name TEXT NOT NULL,      -- Name of the transcript (e.g., "BRCA1_Transcript_1")
-    start INT,                          -- Start position of this transcript
+    chromosome_id INT,                  -- Chromosome of the transcript (same as its gene)
+    start INT,                          -- Start position of this transcript (start <= stop on both strands)
     stop INT,                            -- End position of this transcript
+    strand TEXT,                        -- '+' or '-'
+    tss INT,                            -- Transcription start site: start on '+', stop on '-' strand
     FOREIGN KEY (gene_id) REFERENCES genes(id)  -- Link to the gene this transcript belongs to
 );
 
 -- Table for storing BED data (linking to experiments)
+-- Clustered by position: the peaks of a chromosome region are one sequential range of the table
 CREATE TABLE bed (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,             -- Unique ID for each BED entry
-    experiment_id INT NOT NULL,         -- Foreign key linking to experiments
-    chromosome TEXT NOT NULL,           -- Chromosome where the peak is located
+    chromosome_id INT NOT NULL,         -- Chromosome where the peak is located (chromosomes.id)
     start INT NOT NULL,                 -- Start position of the peak
+    id INT NOT NULL,                    -- Unique ID for each BED entry (assigned by the loaders)
+    experiment_id INT NOT NULL,         -- Foreign key linking to experiments
     stop INT NOT NULL,                   -- End position of the peak
     peak_score FLOAT,                   -- Optional: Peak score or other metric
     feature_name TEXT,                  -- Optional: Name of the feature (e.g., TF or region)
+    PRIMARY KEY (chromosome_id, start, id),
     FOREIGN KEY (experiment_id) REFERENCES experiments(id)
-);
+) WITHOUT ROWID;
+
+-- Indexes of the peak filters (experiment, minimum score); see BED_INDEXES in flask_app.py
+CREATE INDEX idx_bed_experiment ON bed(experiment_id);
+CREATE INDEX idx_bed_peak_score ON bed(peak_score);
 
 /*
 